@@ -1,7 +1,12 @@
 import logging
 import sys
 import argparse
+import codecs
 import os
+import posixpath
+import tarfile
+import zipfile
+import zlib
 
 from pathlib import Path
 
@@ -9,93 +14,59 @@ import CPlugSurface
 import CPlugVisualIndexedTriangles
 
 from CPlugErrors import NoTrimeshError, NoVerticesError, NoFacesError
-from modules.threedees import read_3ds, IncorrectFormatError, DataError, EditorChunk, ObjectBlock
+from modules.archives import is_archive, iter_models
+from modules.cache import load_objects
+from modules.geometry import NORMAL_WEIGHTINGS
+from modules.output import open_output
+from modules.threedees import iter_objects, IncorrectFormatError, DataError, EditorChunk, ObjectFilter, ParsePlan, \
+    start_trace, stop_trace, NAME_ENCODING
 
 VERSION = '1.0.8'
 
-if __name__ == '__main__':
-    parser = argparse.ArgumentParser(
-        prog='3ds2gbxml'
-    )
-    parser.add_argument('file')
-    parser.add_argument('-lf', '--logfile',
-                        dest='logfile')
-    parser.add_argument('-i', '--info',
-                        dest='verbose', action='store_true')
-    parser.add_argument('-v', '--visual',
-                        dest='visual', action='store_true')
-    parser.add_argument('-a', '--animate',
-                        dest='animate', action='store_true')
-    parser.add_argument('-s', '--surface',
-                        dest='surface', action='store_true')
-    parser.add_argument('--tmf',
-                        dest='tmf', action='store_true')
-
-    args = parser.parse_args()
-
-    # Set up logger
-    loglevel = logging.WARNING
-    if args.verbose:
-        loglevel = logging.INFO
-
-    logfile = None
-    if args.logfile:
-        logfile = args.logfile
-
-    logging.basicConfig(
-        level=loglevel,
-        format='%(asctime)s-[%(levelname)s]: %(message)s',
-        filename=logfile
-    )
-
-    logging.info(f'3ds2gbxml version {VERSION}')
-
-    if not args.visual and not args.surface and not args.animate:
-        logging.error('Conversion Error: no mode selected')
-        sys.exit(1)
-
 
+def convert_model(args: argparse.Namespace, plan: ParsePlan, output, source, model_name: str, out_dir: str,
+                  saved_to: list) -> int:
+    """Convert one model, appending the files written to `saved_to`.
 
+    Returns 0 on success, or else the exit status after logging what went wrong.
+    """
     try:
-        logging.info('===============================')
-        chunk = read_3ds(args.file)
-
-        objects: list = []
+        logging.info(f'Converting "{model_name}"')
+        saved_before = len(saved_to)
         # Find model objects in the file
-        for editor_chunk in chunk.children:
-            if isinstance(editor_chunk, EditorChunk):
-                for obj in editor_chunk.children:
-                    if isinstance(obj, ObjectBlock):
-                        if len(obj.children) > 0:
-                            objects.append(obj)
-        if len(objects) == 0:
-            logging.error('Conversion Error: no objects to convert')
-            sys.exit(1)
+        if args.cache:
+            objects = (obj for obj in load_objects(source, args.cache, plan) if len(obj.children) > 0)
+        else:
+            objects = (obj for obj in iter_objects(source, plan) if len(obj.children) > 0)
+        if args.animate or args.surface:
+            objects = list(objects)
+            if len(objects) == 0:
+                logging.error('Conversion Error: no objects to convert')
+                return 1
+        # otherwise the visual meshes are written as the objects are read, one at a time
 
-        saved_to: list = []
         if args.animate:
             # Add SubVisuals
             try:
                 logging.info('===============================')
-                gbx_tree = CPlugVisualIndexedTriangles.create_anim_xml(objects)
+                gbx_tree = CPlugVisualIndexedTriangles.create_anim_xml(objects, args.normals)
                 print(gbx_tree)
-                save_path_file = f"{Path(args.file).stem}.CPlugVisualIndexedTriangles.xml"
-                with open(save_path_file, "wb") as f:
-                    gbx_tree.write(f)
-                    logging.info(f'Saved to "{save_path_file}')
-                    saved_to.append(save_path_file)
+                save_path_file = output.write(
+                    posixpath.join(out_dir, f"{model_name}.CPlugVisualIndexedTriangles.xml"), gbx_tree)
+                logging.info(f'Saved to "{save_path_file}')
+                saved_to.append(save_path_file)
             except OSError as e:
                 logging.error(f'Failed to open "{e.filename}" for writing, message: {e.args[1]}')
-                sys.exit(e.errno)
+                return e.errno
             except NoTrimeshError:
                 logging.error('Conversion Error: No mesh present')
-                sys.exit(1)
+                return 1
             except NoVerticesError:
                 logging.error('Conversion Error: No vertices present')
-                sys.exit(1)
+                return 1
             except NoFacesError:
                 logging.error('Conversion Error: No faces present')
-                sys.exit(1)
+                return 1
 
         else:
             for model_obj in objects:
@@ -104,61 +75,225 @@ if __name__ == '__main__':
                 if args.visual:
                     try:
                         logging.info('===============================')
-                        gbx_tree = CPlugVisualIndexedTriangles.create_xml(model_obj)
-                        save_path_file = f"{name}.CPlugVisualIndexedTriangles.xml"
-                        with open(save_path_file, "wb") as f:
-                            gbx_tree.write(f)
-                            logging.info(f'Saved to "{save_path_file}')
-                            saved_to.append(save_path_file)
+                        gbx_tree = CPlugVisualIndexedTriangles.create_xml(model_obj, args.normals)
+                        save_path_file = output.write(
+                            posixpath.join(out_dir, f"{name}.CPlugVisualIndexedTriangles.xml"), gbx_tree)
+                        logging.info(f'Saved to "{save_path_file}')
+                        saved_to.append(save_path_file)
                     except OSError as e:
                         logging.error(f'Failed to open "{e.filename}" for writing, message: {e.args[1]}')
-                        sys.exit(e.errno)
+                        return e.errno
                     except NoTrimeshError:
                         logging.error('Conversion Error: No mesh present')
-                        sys.exit(1)
+                        return 1
                     except NoVerticesError:
                         logging.error('Conversion Error: No vertices present')
-                        sys.exit(1)
+                        return 1
                     except NoFacesError:
                         logging.error('Conversion Error: No faces present')
-                        sys.exit(1)
+                        return 1
+            if not args.surface and len(saved_to) == saved_before:  # streamed, so only known now
+                logging.error('Conversion Error: no objects to convert')
+                return 1
 
             # To Collision Surface
             if args.surface:
                 try:
                     logging.info('===============================')
-                    gbx_tree = CPlugSurface.create_xml(objects, args.tmf)
+                    gbx_tree = CPlugSurface.create_xml(objects, args.tmf, args.weld)
                     if args.tmf:
-                        save_path_file = f"{Path(args.file).stem}.CPlugSurfaceGeom.xml"
+                        save_path_file = f"{model_name}.CPlugSurfaceGeom.xml"
                     else:
-                        save_path_file = f"{Path(args.file).stem}.CPlugSurfaceCrystal.xml"
-                    with open(save_path_file, "wb") as f:
-                        gbx_tree.write(f)
-                        logging.info(f'Saved to "{save_path_file}')
-                        saved_to.append(save_path_file)
+                        save_path_file = f"{model_name}.CPlugSurfaceCrystal.xml"
+                    save_path_file = output.write(posixpath.join(out_dir, save_path_file), gbx_tree)
+                    logging.info(f'Saved to "{save_path_file}')
+                    saved_to.append(save_path_file)
                 except OSError as e:
                     logging.error(f'Failed to open "{e.filename}" for writing, message: {e.args[1]}')
-                    sys.exit(e.errno)
+                    return e.errno
                 except NoTrimeshError:
                     logging.error('Conversion Error: No mesh present')
-                    sys.exit(1)
+                    return 1
                 except NoVerticesError:
                     logging.error('Conversion Error: No vertices present')
-                    sys.exit(1)
+                    return 1
                 except NoFacesError:
                     logging.error('Conversion Error: No faces present')
-                    sys.exit(1)
-    
+                    return 1
+                except ValueError as e:  # welding epsilon out of range
+                    logging.error(f'Conversion Error: {e}')
+                    return 1
+
     except OSError as e:
         logging.error(f'Failed to open "{e.filename}" for reading, message: {e.args[1]}')
-        sys.exit(e.errno)
+        return e.errno
     except IncorrectFormatError:
         logging.error('Parser Error: incorrect 3ds file')
-        sys.exit(1)
+        return 1
     except DataError as e:
         logging.error(f'Parser Error: incorrect data at offset: {hex(e.position)}, message: "{e.args[0]}"')
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        prog='3ds2gbxml'
+    )
+    parser.add_argument('file',
+                        help="the .3ds file to convert, a zip or tar archive to convert every .3ds file in it, "
+                             "or '-' to read one from stdin")
+    parser.add_argument('-lf', '--logfile',
+                        dest='logfile')
+    parser.add_argument('-i', '--info',
+                        dest='verbose', action='store_true')
+    parser.add_argument('-v', '--visual',
+                        dest='visual', action='store_true')
+    parser.add_argument('-a', '--animate',
+                        dest='animate', action='store_true')
+    parser.add_argument('-s', '--surface',
+                        dest='surface', action='store_true')
+    parser.add_argument('--tmf',
+                        dest='tmf', action='store_true')
+    parser.add_argument('--weld',
+                        dest='weld', type=float, metavar='EPSILON',
+                        help='merge surface vertices at most about EPSILON apart, 0 merges exact duplicates only')
+    parser.add_argument('--object',
+                        dest='objects', action='append', metavar='NAME',
+                        help='only convert objects whose name matches this glob pattern (repeatable)')
+    parser.add_argument('--exclude',
+                        dest='exclude', action='append', metavar='NAME',
+                        help='skip objects whose name matches this glob pattern (repeatable)')
+    parser.add_argument('--normals',
+                        dest='normals', choices=NORMAL_WEIGHTINGS, default='uniform',
+                        help='how faces are weighted when computing vertex normals (default: uniform)')
+    parser.add_argument('--trace',
+                        dest='trace', metavar='FILE',
+                        help='write per chunk type decode counts and timings to this JSON file')
+    parser.add_argument('-o', '--output',
+                        dest='output', metavar='DIR',
+                        help="directory to write the converted files to (default: the current one), a .zip or .tar[.gz|.bz2|.xz] "
+                             "archive to create, or '-' to stream them to stdout as a tar archive")
+    parser.add_argument('--name',
+                        dest='name',
+                        help='base name of the files made from the whole model (default: the input file name)')
+    parser.add_argument('--cache',
+                        dest='cache', metavar='DIR',
+                        help='keep the parsed meshes in this directory and reuse them on later runs')
+    parser.add_argument('--encoding',
+                        dest='encoding', default=NAME_ENCODING,
+                        help=f'text encoding of object and material names (default: {NAME_ENCODING})')
+
+    args = parser.parse_args()
+
+    stdout = sys.stdout.buffer
+    if args.output == '-':
+        # stdout carries the archive, so everything else printed goes to stderr
+        sys.stdout = sys.stderr
+
+    # Set up logger
+    loglevel = logging.WARNING
+    if args.verbose:
+        loglevel = logging.INFO
+
+    logfile = None
+    if args.logfile:
+        logfile = args.logfile
+
+    logging.basicConfig(
+        level=loglevel,
+        format='%(asctime)s-[%(levelname)s]: %(message)s',
+        filename=logfile
+    )
+
+    logging.info(f'3ds2gbxml version {VERSION}')
+
+    if not args.visual and not args.surface and not args.animate:
+        logging.error('Conversion Error: no mode selected')
         sys.exit(1)
 
+    try:
+        codecs.lookup(args.encoding)
+    except LookupError:
+        logging.error(f'Conversion Error: unknown encoding "{args.encoding}"')
+        sys.exit(1)
+
+
+
+    if args.trace:
+        start_trace()
+
+    output = None
+    try:
+        output = open_output(args.output, stdout)
+        logging.info('===============================')
+        object_filter = None
+        if args.objects or args.exclude:
+            object_filter = ObjectFilter(args.objects, args.exclude)
+        # Only read the chunks the selected outputs use
+        chunk_types = {EditorChunk}
+        if args.animate:
+            chunk_types |= CPlugVisualIndexedTriangles.REQUIRED_CHUNKS
+        else:
+            if args.visual:
+                chunk_types |= CPlugVisualIndexedTriangles.REQUIRED_CHUNKS
+            if args.surface:
+                chunk_types |= CPlugSurface.REQUIRED_CHUNKS
+        plan = ParsePlan(chunk_types, object_filter, encoding=args.encoding)
+
+        # (source, base name for whole-model files, output directory) of each model to convert,
+        # models from an archive are read one at a time and each get a directory named after them,
+        # next to where they were in the archive, so models with objects of the same name do not clash
+        from_archive = args.file != '-' and is_archive(args.file)
+        if args.file == '-':
+            inputs = [(sys.stdin.buffer, args.name or 'stdin', '')]
+        elif from_archive:
+            inputs = ((data, Path(member).stem, posixpath.splitext(member)[0])
+                      for member, data in iter_models(args.file))
+        else:
+            inputs = [(args.file, args.name or Path(args.file).stem, '')]
+
+        saved_to: list = []
+        failed: list = []
+        for source, model_name, out_dir in inputs:
+            status = convert_model(args, plan, output, source, model_name, out_dir, saved_to)
+            if status and not from_archive:
+                sys.exit(status)
+            if status:  # one bad member does not stop the rest of the pack
+                logging.error(f'Failed to convert "{out_dir}", '
+                              f'continuing with the next model')
+                failed.append(status)
+
+        if failed:
+            logging.error(f'Conversion Error: {len(failed)} models in the archive failed to convert')
+            sys.exit(failed[0])
+        if len(saved_to) == 0:  # an archive without any models
+            logging.error('Conversion Error: no .3ds files to convert')
+            sys.exit(1)
+
+    except OSError as e:
+        logging.error(f'Failed to open "{e.filename}" for reading, message: {e.args[1]}')
+        sys.exit(e.errno)
+    except (tarfile.TarError, zipfile.BadZipFile, zlib.error, EOFError) as e:  # truncated or corrupt archive
+        logging.error(f'Archive Error: failed to read "{args.file}", message: {e}')
+        sys.exit(1)
+    finally:
+        # reached on errors too, so an archive holds whatever was converted before them
+        if output is not None:
+            try:
+                output.close()
+            except OSError as e:
+                logging.error(f'Failed to finish writing the output, message: {e}')
+                sys.exit(1)
+
+    if args.trace:
+        try:
+            with open(args.trace, 'w') as f:
+                stop_trace().dump(f)
+        except OSError as e:
+            logging.error(f'Failed to open "{e.filename}" for writing, message: {e.args[1]}')
+            sys.exit(e.errno)
+
     logging.info('Done!')
     print(f'Successfully saved the following {len(saved_to)} files:')
     for file_path in saved_to:
@@ -1,10 +1,15 @@
 import logging
 import xml.etree.ElementTree as ET
 
-from modules.threedees import FacesDescription, TriangularMesh, VerticesList, FacesMaterial
-from CPlugErrors import NoTrimeshError, NoVerticesError, NoFacesError
+from modules.threedees import FacesDescription, TriangularMesh, VerticesList, FacesMaterial, ObjectBlock, MergedMesh, \
+    merge_objects
+from CPlugErrors import NoVerticesError, NoFacesError
+from modules.geometry import face_planes
 import numpy
 
+# Chunk types read by create_xml, everything else can be skipped when parsing
+REQUIRED_CHUNKS = {ObjectBlock, TriangularMesh, VerticesList, FacesDescription, FacesMaterial}
+
 SURF_DICT = {
     'Concrete': 0,
     'Pavement': 1,
@@ -80,82 +85,62 @@ def _is_number(text: str):
         return False
 
 
-def _calculate_bounding_box(verts):
-    max_x = verts[0].pos[0]
-    max_y = verts[0].pos[1]
-    max_z = verts[0].pos[2]
-    min_x = max_x
-    min_y = max_y
-    min_z = max_z
-    for v in verts:
-        # get biggest x y z values
-        if v.pos[0] > max_x:
-            max_x = v.pos[0]
-        if v.pos[1] > max_y:
-            max_y = v.pos[1]
-        if v.pos[2] > max_z:
-            max_z = v.pos[2]
-        # get smallest x y z values
-        if v.pos[0] < min_x:
-            min_x = v.pos[0]
-        if v.pos[1] < min_y:
-            min_y = v.pos[1]
-        if v.pos[2] < min_z:
-            min_z = v.pos[2]
-    # calculate center of the mesh
-    cen_x = (max_x + min_x) / 2
-    cen_y = (max_y + min_y) / 2
-    cen_z = (max_z + min_z) / 2
-    # calculate size of the mesh
-    siz_x = (max_x - min_x) / 2
-    siz_y = (max_y - min_y) / 2
-    siz_z = (max_z - min_z) / 2
-    return cen_x, cen_y, cen_z, siz_x, siz_y, siz_z
-
-
-def _create_mesh(chunk: ET.Element, vertices_all: list, triangles_all: list, materials_all: dict):
+def _surface_ids(mesh: MergedMesh) -> numpy.ndarray:
+    """Surface id (uint16) of every face, resolved once per material.
+
+    A material name is looked up in SURF_DICT, or else taken as the id itself when it is a number.
+    Faces whose material resolves to neither get 0 (Concrete), with one warning per material.
+    """
+    face_counts = numpy.bincount(mesh.material_ids + 1, minlength=len(mesh.materials) + 1).tolist()
+    ids = numpy.zeros(len(mesh.materials) + 1, dtype=numpy.uint16)  # ids[0] for faces without a material
+    missing = face_counts[0]
+    for material_id, name in enumerate(mesh.materials, 1):
+        if not face_counts[material_id]:
+            continue
+        surf_type = SURF_DICT.get(name)  # try to get surface id by name
+        if surf_type is None and _is_number(name) and 0 <= int(name) <= 0xffff:  # check if its a number instead
+            surf_type = int(name)
+        if surf_type is not None:
+            ids[material_id] = surf_type
+        elif name:  # not found, default to 0
+            logging.warning(f'Could not find material \"{name}\" used by {face_counts[material_id]} faces, '
+                            f'setting to 0 (Concrete)')
+        else:
+            missing += face_counts[material_id]
+    if missing:
+        logging.warning(f'Could not find material for {missing} faces, setting to 0 (Concrete)')
+    return ids[mesh.material_ids + 1]
+
+
+def _create_mesh(chunk: ET.Element, mesh: MergedMesh):
     _set_value(chunk, 'uint32', '2')  # version
     lst = ET.Element('list')
 
     # add vertex positions
-    for vertex in vertices_all:
+    for point in mesh.positions.tolist():
         le = ET.Element('element')
-        _set_value(le, 'vec3', f'{vertex.pos[0]} {vertex.pos[1]} {vertex.pos[2]}')
+        _set_value(le, 'vec3', f'{point[0]} {point[1]} {point[2]}')
         lst.append(le)
 
     chunk.append(lst)
 
     lst = ET.Element('list')
 
-    for i, polygon in enumerate(triangles_all):
+    planes = face_planes(mesh.positions, mesh.faces)
+    degenerate = numpy.flatnonzero(~planes[:, :3].any(axis=1))
+    if len(degenerate):
+        shown = ', '.join(str(i) for i in degenerate[:10].tolist()) + (', ...' if len(degenerate) > 10 else '')
+        logging.warning(f'{len(degenerate)} faces have no area, writing an empty plane for them (faces {shown})')
+
+    surface_ids = _surface_ids(mesh)
+    for plane, polygon, surf_type in zip(planes.tolist(), mesh.faces.tolist(), surface_ids.tolist()):
         le = ET.Element('element')
-        # calculate face normal
-        v_a = numpy.array(vertices_all[polygon[0]].pos)
-        v_b = numpy.array(vertices_all[polygon[1]].pos)
-        v_c = numpy.array(vertices_all[polygon[2]].pos)
-        cross = numpy.cross(v_b - v_a, v_c - v_a)
-        direct = cross / numpy.linalg.norm(cross)
-        dot = numpy.dot(direct, vertices_all[polygon[0]].pos)
-        _set_value(le, 'vec4', f'{direct[0]} {direct[1]} {direct[2]} {-dot}')
+        _set_value(le, 'vec4', f'{plane[0]} {plane[1]} {plane[2]} {plane[3]}')
         # set polygon points
         _set_value(le, 'uint32', str(polygon[0]))
         _set_value(le, 'uint32', str(polygon[1]))
         _set_value(le, 'uint32', str(polygon[2]))
-        value = ET.Element('uint16')  # SurfaceType
-        mat = materials_all.get(i)  # get material name from face index
-        if mat:
-            surf_type = SURF_DICT.get(mat)  # try to get surface id by name
-            if surf_type is not None:  # found
-                value.text = str(surf_type)
-            elif _is_number(mat):  # check if its a number instead
-                value.text = mat
-            else:  # not found, default to 0
-                logging.warning(f'Could not find material \"{mat}\", setting to 0 (Concrete)')
-                value.text = '0'
-        else:  # not found, default to 0
-            logging.warning(f'Could not find material for face {i}, setting to 0 (Concrete)')
-            value.text = '0'
-        le.append(value)
+        _set_value(le, 'uint16', str(surf_type))  # SurfaceType
         # idk what these are
         _set_value(le, 'uint8', '0')
         _set_value(le, 'uint8', '0')
@@ -170,7 +155,7 @@ def _create_mesh(chunk: ET.Element, vertices_all: list, triangles_all: list, mat
         _set_value(chunk, 'int32', '0')
         _set_value(chunk, 'int32', '0')
     else:
-        box = _calculate_bounding_box(vertices_all)
+        box = mesh.bounds.as_box()
 
         lst = ET.Element('list')
         ole = ET.Element('element')
@@ -186,64 +171,29 @@ def _create_mesh(chunk: ET.Element, vertices_all: list, triangles_all: list, mat
         chunk.append(lst)
 
 
-def create_xml(objects: list, tmf_mode: bool) -> ET.ElementTree:
+def create_xml(objects: list, tmf_mode: bool, weld: float = None) -> ET.ElementTree:
+    """Collision surface of the objects. `weld` is the epsilon to weld vertices with, None to keep them all"""
     # Prepare objects
 
     logging.info(f'Converting all objects to one Surface...')
 
-    vert_count = 0
-    face_count = 0
-    vertices_all = []
-    triangles_all = []
-    materials_all = {}
-
-    # adding all the vertices and faces into big global arrays
-    # setting the vertex and face indexes by an offset
-    for model_object in objects:
-        new_vert_count = 0
-        new_face_count = 0
-
-        trimesh: TriangularMesh = model_object.children[0]
-        if not trimesh or not isinstance(trimesh, TriangularMesh):
-            raise NoTrimeshError
-        
-        tris = None
-
-        for child in trimesh.children:
-            if isinstance(child, VerticesList):
-                new_vert_count = len(child.vertices)
-                vertices_all = vertices_all + child.vertices
-
-            if isinstance(child, FacesDescription):
-                tris = child
-                temp = child.polygons.copy()
-                for i in range(len(temp)):  # Update vertex references
-                    poly = temp[i]
-                    new_poly = (poly[0] + vert_count, poly[1] + vert_count, poly[2] + vert_count)
-                    temp[i] = new_poly
-                new_face_count = len(temp)
-                triangles_all = triangles_all + temp
-        # do materials
-        if tris:
-            for child in tris.children:
-                if isinstance(child, FacesMaterial):
-                    name = child.material_name
-                    temp = child.applied_faces.copy()
-                    for i in range(len(temp)):  # Update face references
-                        temp[i] = temp[i] + face_count
-                        materials_all[temp[i]] = name
-
-        vert_count = vert_count + new_vert_count
-        face_count = face_count + new_face_count
-
-    if len(triangles_all) == 0:
+    mesh = merge_objects(objects)
+
+    if weld is not None:
+        welded = mesh.welded(weld)
+        collapsed = len(mesh.faces) - len(welded.faces)
+        print(f'Welded {len(mesh.positions)} vertices into {len(welded.positions)}'
+              + (f', removed {collapsed} collapsed faces' if collapsed else ''))
+        mesh = welded
+
+    if len(mesh.faces) == 0:
         raise NoFacesError
-    if len(vertices_all) == 0:
+    if len(mesh.positions) == 0:
         raise NoVerticesError
 
-    logging.info(f'Vertex: {len(vertices_all)}')
-    logging.info(f'Polygons: {len(triangles_all)}')
-    print(f'Estimated copper cost of the block: {len(vertices_all) / 100}')
+    logging.info(f'Vertex: {len(mesh.positions)}')
+    logging.info(f'Polygons: {len(mesh.faces)}')
+    print(f'Estimated copper cost of the block: {len(mesh.positions) / 100}')
 
     # Do the thing
 
@@ -257,12 +207,12 @@ def create_xml(objects: list, tmf_mode: bool) -> ET.ElementTree:
         chunk = ET.Element('chunk')
         _set_multiple(chunk, {'class': '0900F000', 'id': '004'})
         chunk.append(ET.Element('lookbackstr'))
-        box = _calculate_bounding_box(vertices_all)
+        box = mesh.bounds.as_box()
         _set_value(chunk, 'vec3', f'{box[0]} {box[1]} {box[2]}')
         _set_value(chunk, 'vec3', f'{box[3]} {box[4]} {box[5]}')
         _set_value(chunk, 'uint32', '7')
 
-        _create_mesh(chunk, vertices_all, triangles_all, materials_all)
+        _create_mesh(chunk, mesh)
 
         _set_value(chunk, 'uint16', '0')
         body.append(chunk)
@@ -289,7 +239,7 @@ def create_xml(objects: list, tmf_mode: bool) -> ET.ElementTree:
         chunk = ET.Element('chunk')
         _set_multiple(chunk, {'class': '0900D000', 'id': '002'})
 
-        _create_mesh(chunk, vertices_all, triangles_all, materials_all)
+        _create_mesh(chunk, mesh)
 
         body.append(chunk)
 
@@ -4,11 +4,18 @@ import os
 import numpy as np
 import xml.etree.ElementTree as ET
 from modules.threedees import FacesDescription, MappingCoordinatesList, TriangularMesh, VerticesList, \
-    MappingCoordinates, ObjectBlock, Vertex, \
-    VertexColors, VertexNormals
+    MappingCoordinates, ObjectBlock, \
+    VertexColors, VertexNormals, SmoothGroup
 from CPlugErrors import NoTrimeshError, NoVerticesError, NoFacesError
+from modules.geometry import vertex_normals, smooth_vertex_normals
 
 
+# Chunk types read by create_xml and create_anim_xml, everything else can be skipped when parsing
+REQUIRED_CHUNKS = {ObjectBlock, TriangularMesh, VerticesList, FacesDescription, MappingCoordinates,
+                   MappingCoordinatesList, VertexColors, VertexNormals, SmoothGroup}
+
+MAX_VERTICES = 65536  # faces index vertices with uint16
+
 GBX_XML_HEADER = {
     'version': '6',
     'unknown': 'R',
@@ -17,41 +24,56 @@ GBX_XML_HEADER = {
 }
 
 
-def compute_normals_gm(vertex: list[Vertex], faces: list[tuple]):
-    normals = []
-
-    for face in faces:
-        A = np.array(vertex[face[0]].pos)
-        B = np.array(vertex[face[1]].pos)
-        C = np.array(vertex[face[2]].pos)
-        AB = A - B
-        AC = A - C
-
-    return normals
-
-
-def compute_normals(vertex: list[Vertex], facet: list[tuple]):
-    logging.info('Computing normals from faces')
-    normals = []
-    vertexNormalLists = [[] for i in range(0, len(vertex))]
-    for face in facet:
-        a = vertex[face[0]].pos
-        b = vertex[face[1]].pos
-        c = vertex[face[2]].pos
-        AB = np.array(a) - np.array(b)
-        AC = np.array(a) - np.array(c)
-        n = np.cross(AB, AC)
-        n /= np.linalg.norm(n)
-        for i in range(0, 3):
-            vertexNormalLists[face[i]].append(n)
-    for idx, normalList in enumerate(vertexNormalLists):
-        normalSum = np.zeros(3)
-        for normal in normalList:
-          normalSum += normal
-        normal = normalSum / float(len(normalList))
-        normal /= np.linalg.norm(normal)
-        normals.append(map(float, normal.tolist()))
-    return normals
+def _split_by_smoothing_groups(vertices: VerticesList, triangles: FacesDescription, base_uv: MappingCoordinates,
+                               uv_list: MappingCoordinatesList, colors: VertexColors, weighting: str):
+    """Normals following the smoothing groups of the faces, with the mesh chunks redone for the split vertices.
+
+    Returns (normals, vertices, triangles, base_uv, uv_list, colors), or None when the faces
+    have no usable smoothing groups or the vertex attributes could not follow the split.
+    """
+    groups = None
+    for child in triangles.children:
+        if isinstance(child, SmoothGroup):
+            groups = child.smooth_group_list
+    if groups is None:
+        return None
+    if len(groups) != len(triangles.faces):
+        logging.warning(f'Smoothing groups do not match the faces ({len(groups)} for {len(triangles.faces)}), '
+                        f'ignoring them')
+        return None
+
+    # split vertices copy their attributes from the vertex they come from, which needs one per vertex
+    vertex_count = len(vertices.positions)
+    attributes = []
+    if base_uv:
+        attributes.append(('UVs', base_uv.uvs))
+    if uv_list:
+        attributes += [(f'UV layer {i}', layer) for i, layer in enumerate(uv_list.uv_layers)]
+    if colors:
+        attributes.append(('vertex colors', colors.colors))
+    mismatched = [f'{name} ({len(array)})' for name, array in attributes if len(array) != vertex_count]
+    if mismatched:
+        logging.warning(f'{", ".join(mismatched)} do not match the {vertex_count} vertices, ignoring smoothing groups')
+        return None
+
+    logging.info('Computing normals from faces and smoothing groups')
+    normals, faces, source = smooth_vertex_normals(vertices.positions, triangles.faces, groups, weighting)
+    if len(source) > MAX_VERTICES:
+        logging.warning(f'Splitting vertices by smoothing groups makes {len(source)} vertices, '
+                        f'more than {MAX_VERTICES}, ignoring smoothing groups')
+        return None
+
+    vertices = VerticesList.from_values(vertices.my_chunk_id, positions=vertices.positions[source])
+    faces = np.column_stack((faces, triangles.faces[:, 3])).astype(np.uint16)
+    triangles = FacesDescription.from_values(triangles.my_chunk_id, faces=faces)
+    if base_uv:
+        base_uv = MappingCoordinates.from_values(base_uv.my_chunk_id, uvs=base_uv.uvs[source])
+    if uv_list:
+        uv_list = MappingCoordinatesList.from_values(
+            uv_list.my_chunk_id, uv_layers=[layer[source] for layer in uv_list.uv_layers])
+    if colors:
+        colors = VertexColors.from_values(colors.my_chunk_id, colors=colors.colors[source])
+    return normals.tolist(), vertices, triangles, base_uv, uv_list, colors
 
 
 def _set_multiple(node: ET.Element, attrib: dict):
@@ -59,7 +81,7 @@ def _set_multiple(node: ET.Element, attrib: dict):
         node.set(key, value)
 
 
-def create_anim_xml(objects: list) -> ET.ElementTree:
+def create_anim_xml(objects: list, normal_weighting: str = 'uniform') -> ET.ElementTree:
     logging.info(f'Converting objects to animated VisualMesh...')
 
     base_object = objects[0]
@@ -111,21 +133,21 @@ def create_anim_xml(objects: list) -> ET.ElementTree:
         raise NoVerticesError
 
     if base_uv:
-        logging.info(f'Base UV: {len(base_uv.uv)}')
+        logging.info(f'Base UV: {len(base_uv.uvs)}')
     if uv_list:
-        logging.info(f'UV count: {len(uv_list.uv_list)}')
-        for i in range(len(uv_list.uv_list)):
-            logging.info(f'--- Count: {len(uv_list.uv_list[i])}')
-    logging.info(f'Vertex: {len(vertices.vertices)}')
-    logging.info(f'Polygons: {len(triangles.polygons)}')
+        logging.info(f'UV count: {len(uv_list.uv_layers)}')
+        for layer in uv_list.uv_layers:
+            logging.info(f'--- Count: {len(layer)}')
+    logging.info(f'Vertex: {len(vertices.positions)}')
+    logging.info(f'Polygons: {len(triangles.faces)}')
     if colors:
-        logging.info(f'Colors: {len(colors.vertex_colors)}')
+        logging.info(f'Colors: {len(colors.colors)}')
         # some weird fix that doesnt work
         # i really need to make a new exporter instead
         # color_diff = int((len(vertices.vertices) - len(colors.vertex_colors)) / 2)
         # color_diff = len(vertices.vertices) - len(colors.vertex_colors)
 
-    normals = compute_normals(vertices.vertices, triangles.polygons)
+    normals = vertex_normals(vertices.positions, triangles.faces, normal_weighting).tolist()
 
     gbx = ET.Element('gbx')
     _set_multiple(gbx, GBX_XML_HEADER)
@@ -218,7 +240,6 @@ def create_anim_xml(objects: list) -> ET.ElementTree:
     if uv_list:
         logging.info('Writing Additional UVs')
         for i, uv in enumerate(uv_list.uv_list):
-            logging.info(f'{i}')
             value = ET.Element('bool')
             value.text = '0'
             chunk.append(value)
@@ -227,7 +248,6 @@ def create_anim_xml(objects: list) -> ET.ElementTree:
                 for uv_coord in uv:
                     value = ET.Element('vec2')
                     value.text = f'{uv_coord[0]} {uv_coord[1]}'
-                    logging.info(value.text)
                     chunk.append(value)
     elif base_uv:
         logging.info('Writing Base UV')
@@ -239,7 +259,6 @@ def create_anim_xml(objects: list) -> ET.ElementTree:
             for uv_coord in base_uv.uv:
                 value = ET.Element('vec2')
                 value.text = f'{uv_coord[0]} {uv_coord[1]}'
-                logging.info(value.text)
                 chunk.append(value)
 
     value = ET.Element('bool')
@@ -282,7 +301,7 @@ def create_anim_xml(objects: list) -> ET.ElementTree:
             if isinstance(child, VertexNormals):
                 obj_normals: VertexNormals = child
         if not obj_normals:
-            lst_normals = compute_normals(obj_vertices.vertices, obj_tris.polygons)
+            lst_normals = vertex_normals(obj_vertices.positions, obj_tris.faces, normal_weighting).tolist()
         else:
             lst_normals = obj_normals.vertex_normals
 
@@ -355,7 +374,7 @@ def create_anim_xml(objects: list) -> ET.ElementTree:
     return tree
 
 
-def create_xml(model_object: ObjectBlock) -> ET.ElementTree:
+def create_xml(model_object: ObjectBlock, normal_weighting: str = 'uniform') -> ET.ElementTree:
     logging.info(f'Converting "{model_object.name}" to VisualMesh...')
 
     base_uv = None
@@ -391,24 +410,30 @@ def create_xml(model_object: ObjectBlock) -> ET.ElementTree:
 
     base_uv_count = 0
     if base_uv:
-        base_uv_count = len(base_uv.uv)
+        base_uv_count = len(base_uv.uvs)
         logging.info(f'Base UV: {base_uv_count}')
     if uv_list:
-        logging.info(f'UV count: {len(uv_list.uv_list)}')
-        for i in range(len(uv_list.uv_list)):
-            new_uv_count = len(uv_list.uv_list[i])
+        logging.info(f'UV count: {len(uv_list.uv_layers)}')
+        for layer in uv_list.uv_layers:
+            new_uv_count = len(layer)
             logging.info(f'--- Count: {new_uv_count}')
             if new_uv_count != base_uv_count:
                 raise Exception('UV Count mismatch!')
-    logging.info(f'Vertex: {len(vertices.vertices)}')
-    logging.info(f'Polygons: {len(triangles.polygons)}')
+    logging.info(f'Vertex: {len(vertices.positions)}')
+    logging.info(f'Polygons: {len(triangles.faces)}')
     if colors:
-        logging.info(f'Colors: {len(colors.vertex_colors)}')
+        logging.info(f'Colors: {len(colors.colors)}')
 
-    if not obj_normals:
-        normals = compute_normals(vertices.vertices, triangles.polygons)
-    else:
+    if obj_normals:
         normals = obj_normals.vertex_normals
+    else:
+        split = _split_by_smoothing_groups(vertices, triangles, base_uv, uv_list, colors, normal_weighting)
+        if split:
+            normals, vertices, triangles, base_uv, uv_list, colors = split
+            logging.info(f'Vertex after smoothing group split: {len(vertices.positions)}')
+        else:
+            logging.info('Computing normals from faces')
+            normals = vertex_normals(vertices.positions, triangles.faces, normal_weighting).tolist()
 
     gbx = ET.Element('gbx')
     _set_multiple(gbx, GBX_XML_HEADER)
@@ -486,7 +511,6 @@ def create_xml(model_object: ObjectBlock) -> ET.ElementTree:
     if uv_list:
         logging.info('Writing Additional UVs')
         for i, uv in enumerate(uv_list.uv_list):
-            logging.info(f'{i}')
             value = ET.Element('bool')
             value.text = '0'
             chunk.append(value)
@@ -494,7 +518,6 @@ def create_xml(model_object: ObjectBlock) -> ET.ElementTree:
             for uv_coord in uv:
                 value = ET.Element('vec2')
                 value.text = f'{uv_coord[0]} {uv_coord[1]}'
-                logging.info(value.text)
                 chunk.append(value)
     elif base_uv:
         logging.info('Writing Base UV')
@@ -505,7 +528,6 @@ def create_xml(model_object: ObjectBlock) -> ET.ElementTree:
         for uv_coord in base_uv.uv:
             value = ET.Element('vec2')
             value.text = f'{uv_coord[0]} {uv_coord[1]}'
-            logging.info(value.text)
             chunk.append(value)
 
     value = ET.Element('bool')
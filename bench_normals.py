@@ -0,0 +1,77 @@
+import argparse
+import time
+
+import numpy as np
+
+from modules.geometry import NORMAL_WEIGHTINGS, vertex_normals, smooth_vertex_normals
+from modules.threedees import iter_objects, TriangularMesh, VerticesList, FacesDescription
+
+
+def _grid_mesh(size: int, seed: int = 0) -> tuple:
+    """A bumpy, unevenly tessellated grid of size x size quads as (positions, faces, smoothing groups)"""
+    rng = np.random.default_rng(seed)
+    x, y = np.meshgrid(np.linspace(0, 1, size + 1) ** 2, np.linspace(0, 1, size + 1))
+    z = rng.random(x.shape) * 0.05
+    positions = np.column_stack((x.ravel(), y.ravel(), z.ravel())).astype(np.float32)
+    corner = (np.arange(size)[:, None] * (size + 1) + np.arange(size)[None, :]).ravel()
+    faces = np.concatenate((
+        np.column_stack((corner, corner + 1, corner + size + 2)),
+        np.column_stack((corner, corner + size + 2, corner + size + 1))
+    ))
+    groups = 1 << rng.integers(0, 4, len(faces))
+    return positions, faces, groups
+
+
+def _file_meshes(path: str) -> list:
+    meshes = []
+    for model_object in iter_objects(path):
+        vertices = faces = None
+        for trimesh in model_object.children:
+            if isinstance(trimesh, TriangularMesh):
+                for child in trimesh.children:
+                    if isinstance(child, VerticesList):
+                        vertices = child
+                    if isinstance(child, FacesDescription):
+                        faces = child
+        if vertices is not None and faces is not None:
+            meshes.append((vertices.positions, faces.faces, np.ones(len(faces.faces), dtype=np.uint32)))
+    return meshes
+
+
+def _best_time(function, repeat: int) -> float:
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        prog='bench_normals',
+        description='Time the vertex normal weighting modes on a generated mesh or on .3ds files'
+    )
+    parser.add_argument('files', nargs='*')
+    parser.add_argument('--size',
+                        dest='size', type=int, default=300,
+                        help='quads per side of the generated grid mesh (default: 300)')
+    parser.add_argument('--repeat',
+                        dest='repeat', type=int, default=5,
+                        help='runs per mode, the best one is reported (default: 5)')
+
+    args = parser.parse_args()
+
+    if args.files:
+        meshes = [mesh for path in args.files for mesh in _file_meshes(path)]
+    else:
+        meshes = [_grid_mesh(args.size)]
+    vertex_count = sum(len(positions) for positions, _, _ in meshes)
+    face_count = sum(len(faces) for _, faces, _ in meshes)
+    print(f'{len(meshes)} meshes, {vertex_count} vertices, {face_count} faces, best of {args.repeat}')
+
+    for weighting in NORMAL_WEIGHTINGS:
+        plain = _best_time(lambda: [vertex_normals(p, f, weighting) for p, f, _ in meshes], args.repeat)
+        smooth = _best_time(lambda: [smooth_vertex_normals(p, f, g, weighting) for p, f, g in meshes], args.repeat)
+        print(f'{weighting:>8}: {plain * 1000:8.2f} ms, with smoothing groups {smooth * 1000:8.2f} ms')
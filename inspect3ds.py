@@ -0,0 +1,155 @@
+import argparse
+import json
+import logging
+import struct
+import sys
+
+from modules.threedees import index_3ds, ChunkIndex, ChunkIndexEntry, ChunkReader, IncorrectFormatError, \
+    DataError, _read_asciiz_string
+
+# Only the chunk headers are walked, the few values below are read straight from the payloads
+CHUNK_VERSION = 0x0002
+CHUNK_EDITOR = 0x3d3d
+CHUNK_OBJECT = 0x4000
+CHUNK_TRIMESH = 0x4100
+CHUNK_VERTICES = 0x4110
+CHUNK_NORMALS = 0x4112
+CHUNK_COLORS = 0x4115
+CHUNK_FACES = 0x4120
+CHUNK_FACES_MATERIAL = 0x4130
+CHUNK_UV = 0x4140
+CHUNK_UV_LIST = 0x4145
+CHUNK_MATERIAL = 0xafff
+CHUNK_MATERIAL_NAME = 0xa000
+CHUNK_KEYFRAMER = 0xb000
+
+
+def _read_uint16(index: ChunkIndex, entry: ChunkIndexEntry) -> int:
+    return struct.unpack_from('<H', index.view, entry.offset + 6)[0]
+
+
+def _read_name(index: ChunkIndex, entry: ChunkIndexEntry) -> str:
+    return _read_asciiz_string(ChunkReader(index.view, entry.offset + 6, entry.offset + entry.size))
+
+
+def _inspect_object(index: ChunkIndex, entry: ChunkIndexEntry) -> dict:
+    info = {
+        'name': _read_name(index, entry),
+        'vertices': 0,
+        'faces': 0,
+        'uv_layers': 0,
+        'vertex_colors': False,
+        'vertex_normals': False,
+        'materials': []
+    }
+    for mesh in index.children_of(entry.offset):
+        if mesh.chunk_id != CHUNK_TRIMESH:
+            continue
+        for child in index.children_of(mesh.offset):
+            if child.chunk_id == CHUNK_VERTICES:
+                info['vertices'] = _read_uint16(index, child)
+            elif child.chunk_id == CHUNK_FACES:
+                info['faces'] = _read_uint16(index, child)
+                for group in index.children_of(child.offset):
+                    if group.chunk_id == CHUNK_FACES_MATERIAL:
+                        name = _read_name(index, group)
+                        if name not in info['materials']:
+                            info['materials'].append(name)
+            elif child.chunk_id == CHUNK_UV:  # only counts when there is no UV list
+                info['uv_layers'] = max(info['uv_layers'], 1)
+            elif child.chunk_id == CHUNK_UV_LIST:
+                info['uv_layers'] = _read_uint16(index, child)
+            elif child.chunk_id == CHUNK_COLORS:
+                info['vertex_colors'] = True
+            elif child.chunk_id == CHUNK_NORMALS:
+                info['vertex_normals'] = True
+    return info
+
+
+def inspect_file(path: str) -> dict:
+    """Summarize a 3ds file from its chunk headers, without decoding any chunk"""
+    index = index_3ds(path)
+    root = index.entries[0]
+    info = {
+        'file': path,
+        'size': root.size,
+        'chunks': len(index.entries),
+        'version': None,
+        'objects': [],
+        'materials': [],
+        'keyframer': False
+    }
+    for child in index.children_of(root.offset):
+        if child.chunk_id == CHUNK_VERSION:
+            info['version'] = struct.unpack_from('<I', index.view, child.offset + 6)[0]
+        elif child.chunk_id == CHUNK_KEYFRAMER:
+            info['keyframer'] = True
+        elif child.chunk_id == CHUNK_EDITOR:
+            for entry in index.children_of(child.offset):
+                if entry.chunk_id == CHUNK_OBJECT:
+                    info['objects'].append(_inspect_object(index, entry))
+                elif entry.chunk_id == CHUNK_MATERIAL:
+                    for name in index.children_of(entry.offset):
+                        if name.chunk_id == CHUNK_MATERIAL_NAME:
+                            info['materials'].append(_read_name(index, name))
+    return info
+
+
+def _print_info(info: dict):
+    print(f'{info["file"]}: {info["size"]} bytes, {info["chunks"]} chunks, version {info["version"]}')
+    print(f'  keyframer: {"yes" if info["keyframer"] else "no"}')
+    print(f'  materials: {", ".join(info["materials"]) if info["materials"] else "-"}')
+    print(f'  objects: {len(info["objects"])}')
+    for obj in info['objects']:
+        extras = []
+        if obj['vertex_colors']:
+            extras.append('colors')
+        if obj['vertex_normals']:
+            extras.append('normals')
+        print(f'    "{obj["name"]}": {obj["vertices"]} vertices, {obj["faces"]} faces, '
+              f'{obj["uv_layers"]} uv layers{", " + ", ".join(extras) if extras else ""}')
+        if obj['materials']:
+            print(f'      materials: {", ".join(obj["materials"])}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        prog='inspect3ds',
+        description='List the contents of .3ds files without parsing them'
+    )
+    parser.add_argument('files', nargs='+')
+    parser.add_argument('-j', '--json',
+                        dest='json', action='store_true')
+
+    args = parser.parse_args()
+
+    logging.basicConfig(
+        level=logging.WARNING,
+        format='%(asctime)s-[%(levelname)s]: %(message)s'
+    )
+
+    results: list = []
+    failed = False
+    for file_path in args.files:
+        try:
+            results.append(inspect_file(file_path))
+        except OSError as e:
+            logging.error(f'Failed to open "{e.filename}" for reading, message: {e.args[1]}')
+            failed = True
+        except (IncorrectFormatError, struct.error):
+            logging.error(f'Parser Error: "{file_path}" is not a correct 3ds file')
+            failed = True
+        except DataError as e:
+            logging.error(f'Parser Error: "{file_path}" has incorrect data at offset: {hex(e.position)}, '
+                          f'message: "{e.args[0]}"')
+            failed = True
+
+    if args.json:
+        json.dump(results, sys.stdout, indent=2)
+        print()
+    else:
+        for info in results:
+            _print_info(info)
+
+    if failed:
+        sys.exit(1)
@@ -0,0 +1,57 @@
+import fnmatch
+import logging
+import posixpath
+import tarfile
+import zipfile
+
+MODEL_PATTERN = '*.3ds'
+
+
+def is_archive(path: str) -> bool:
+    """Whether the file at `path` is a zip or tar archive rather than a 3ds file"""
+    with open(path, 'rb') as f:
+        if f.read(2) == b'MM':  # 3ds main chunk id, checked first as tar detection is lenient
+            return False
+    return zipfile.is_zipfile(path) or tarfile.is_tarfile(path)
+
+
+def _model_name(name: str, pattern: str) -> str | None:
+    """Normalized member name if the member is a model, None otherwise"""
+    if not fnmatch.fnmatch(posixpath.basename(name).lower(), pattern.lower()):
+        return None
+    normalized = posixpath.normpath(name)
+    if normalized.startswith(('/', '../')) or normalized == '..':
+        logging.warning(f'Skipping archive member "{name}" with a path outside the archive')
+        return None
+    return normalized
+
+
+def iter_models(path: str, pattern: str = MODEL_PATTERN):
+    """Yield (member name, contents) for the models in a zip or tar archive, in archive order.
+
+    Member names are normalized, without a leading './'. Members are read one at a time,
+    a tar archive front to back in a single pass so a compressed one is never decompressed twice.
+    """
+    if zipfile.is_zipfile(path):
+        with zipfile.ZipFile(path) as archive:
+            for info in archive.infolist():
+                name = None if info.is_dir() else _model_name(info.filename, pattern)
+                if name is not None:
+                    yield name, archive.read(info)
+        return
+    with tarfile.open(path, 'r|*') as archive:
+        for member in archive:
+            name = _model_name(member.name, pattern) if member.isfile() else None
+            if name is not None:
+                yield name, archive.extractfile(member).read()
+
+
+def read_single_model(path: str, pattern: str = MODEL_PATTERN) -> bytes | None:
+    """Contents of the only model in an archive, None if there is not exactly one"""
+    found = None
+    for name, data in iter_models(path, pattern):
+        if found is not None:
+            logging.error(f'"{path}" holds more than one model, convert them from the archive one by one')
+            return None
+        found = data
+    return found
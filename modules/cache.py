@@ -0,0 +1,161 @@
+import hashlib
+import logging
+import os
+import tempfile
+import zipfile
+
+import numpy as np
+
+from modules.threedees import Source, ParsePlan, iter_objects, _source_name, EditorChunk, ObjectBlock, \
+    TriangularMesh, VerticesList, FacesDescription, FacesMaterial, SmoothGroup, MappingCoordinates, \
+    MappingCoordinatesList, VertexColors, VertexNormals
+
+# Bump whenever the parser or the layout below changes what ends up in an entry,
+# older entries are then simply never looked up again
+CACHE_VERSION = 1
+
+# Everything the converters can use from an object
+MESH_CHUNKS = {EditorChunk, ObjectBlock, TriangularMesh, VerticesList, FacesDescription, FacesMaterial, SmoothGroup,
+               MappingCoordinates, MappingCoordinatesList, VertexColors, VertexNormals}
+
+
+def cache_key(source: Source, encoding: str) -> str:
+    """Name of the cache entry for a file: its content hash, the parser version and the name encoding.
+
+    `source` is a path or the file contents.
+    """
+    digest = hashlib.sha256()
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        digest.update(source)
+    else:
+        with open(source, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                digest.update(block)
+    return f'{digest.hexdigest()}-{encoding}-v{CACHE_VERSION}.npz'
+
+
+def _mesh_parts(model_object: ObjectBlock) -> dict:
+    """The mesh chunks of an object by type, the last one wins like in the converters"""
+    parts: dict = {}
+    for trimesh in model_object.children:
+        if not isinstance(trimesh, TriangularMesh):
+            continue
+        parts[TriangularMesh] = trimesh
+        for child in trimesh.children:
+            parts[type(child)] = child
+    return parts
+
+
+def _pack(objects: list) -> dict:
+    arrays: dict = {'names': np.array([obj.name for obj in objects], dtype=str)}
+    for i, model_object in enumerate(objects):
+        parts = _mesh_parts(model_object)
+        if VerticesList in parts:
+            arrays[f'{i}/positions'] = parts[VerticesList].positions
+        if FacesDescription in parts:
+            faces = parts[FacesDescription]
+            arrays[f'{i}/faces'] = faces.faces
+            groups = [child for child in faces.children if isinstance(child, FacesMaterial)]
+            arrays[f'{i}/materials'] = np.array([group.material_name for group in groups], dtype=str)
+            arrays[f'{i}/material_counts'] = np.array([len(group.face_indices) for group in groups], dtype=np.uint32)
+            arrays[f'{i}/material_faces'] = np.concatenate(
+                [group.face_indices for group in groups] or [np.empty(0, dtype=np.uint16)])
+            for child in faces.children:
+                if isinstance(child, SmoothGroup):
+                    arrays[f'{i}/smooth_groups'] = np.array(child.smooth_group_list, dtype=np.uint32)
+        if MappingCoordinates in parts:
+            arrays[f'{i}/uvs'] = parts[MappingCoordinates].uvs
+        if MappingCoordinatesList in parts:
+            layers = parts[MappingCoordinatesList].uv_layers
+            arrays[f'{i}/uv_layer_count'] = np.array(len(layers))
+            for j, layer in enumerate(layers):
+                arrays[f'{i}/uv_layers/{j}'] = layer
+        if VertexColors in parts:
+            arrays[f'{i}/colors'] = parts[VertexColors].colors
+        if VertexNormals in parts:
+            arrays[f'{i}/normals'] = parts[VertexNormals].normals
+    return arrays
+
+
+def _unpack(archive) -> list:
+    """Rebuild decoded ObjectBlocks from the arrays of an entry"""
+    stored = set(archive.files)
+    objects: list = []
+    for i, name in enumerate(archive['names'].tolist()):
+        mesh_children: list = []
+        if f'{i}/positions' in stored:
+            mesh_children.append(VerticesList.from_values(0x4110, positions=archive[f'{i}/positions']))
+        if f'{i}/uvs' in stored:
+            mesh_children.append(MappingCoordinates.from_values(0x4140, uvs=archive[f'{i}/uvs']))
+        if f'{i}/uv_layer_count' in stored:
+            layers = [archive[f'{i}/uv_layers/{j}'] for j in range(int(archive[f'{i}/uv_layer_count']))]
+            mesh_children.append(MappingCoordinatesList.from_values(0x4145, uv_layers=layers))
+        if f'{i}/faces' in stored:
+            face_children: list = []
+            material_faces = archive[f'{i}/material_faces']
+            start = 0
+            for material, count in zip(archive[f'{i}/materials'].tolist(), archive[f'{i}/material_counts'].tolist()):
+                face_children.append(FacesMaterial.from_values(
+                    0x4130, material_name=material, face_indices=material_faces[start:start + count]))
+                start += count
+            if f'{i}/smooth_groups' in stored:
+                face_children.append(SmoothGroup.from_values(
+                    0x4150, smooth_group_list=archive[f'{i}/smooth_groups'].tolist()))
+            mesh_children.append(FacesDescription.from_values(0x4120, face_children, faces=archive[f'{i}/faces']))
+        if f'{i}/colors' in stored:
+            mesh_children.append(VertexColors.from_values(0x4115, colors=archive[f'{i}/colors']))
+        if f'{i}/normals' in stored:
+            mesh_children.append(VertexNormals.from_values(0x4112, normals=archive[f'{i}/normals']))
+        trimesh = TriangularMesh.from_values(0x4100, mesh_children)
+        objects.append(ObjectBlock.from_values(0x4000, [trimesh], name=name))
+    return objects
+
+
+def _store(entry_path: str, objects: list):
+    directory = os.path.dirname(entry_path)
+    os.makedirs(directory, exist_ok=True)
+    # written next to the entry and renamed, so a half written entry is never read
+    fd, temp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            np.savez(f, **_pack(objects))
+        os.replace(temp_path, entry_path)
+    except BaseException:
+        os.remove(temp_path)
+        raise
+
+
+def load_objects(source: Source, cache_dir: str, plan: ParsePlan = None) -> list:
+    """Mesh objects of a 3ds file, decoded, taken from the cache when it has them.
+
+    On a miss the whole file is parsed for the mesh chunks and stored, whatever the plan
+    asks for, so the entry serves any later conversion mode. The plan's object filter
+    is applied to what is returned.
+    """
+    plan = plan or ParsePlan()
+    name = _source_name(source)
+    if hasattr(source, 'read'):  # hashed and then parsed, so it is read only once
+        source = source.read()
+    entry_path = os.path.join(cache_dir, cache_key(source, plan.encoding))
+    objects = None
+    if os.path.exists(entry_path):
+        try:
+            with np.load(entry_path) as archive:
+                objects = _unpack(archive)
+            logging.info(f'Loaded "{name}" from cache "{entry_path}"')
+        except (OSError, ValueError, KeyError, zipfile.BadZipFile) as e:
+            logging.warning(f'Ignoring unreadable cache entry "{entry_path}": {e}')
+
+    if objects is None:
+        full_plan = ParsePlan(MESH_CHUNKS, None, plan.registry, plan.encoding)
+        objects = [obj for obj in iter_objects(source, full_plan, lazy=False)
+                   if any(isinstance(child, TriangularMesh) for child in obj.children)]
+        try:
+            _store(entry_path, objects)
+            logging.info(f'Cached "{name}" to "{entry_path}"')
+        except OSError as e:
+            logging.warning(f'Failed to write cache entry "{entry_path}": {e}')
+
+    if plan.object_filter is not None:
+        objects = [obj for obj in objects if plan.object_filter.matches(obj.name)]
+    return objects
@@ -0,0 +1,195 @@
+from typing import NamedTuple
+
+import numpy as np
+
+# How much a face counts towards the normals of its vertices: the same for every face,
+# in proportion to its area, or to its angle at the vertex
+NORMAL_WEIGHTINGS = ('uniform', 'area', 'angle')
+
+
+class Bounds(NamedTuple):
+    """Axis aligned bounding box of a mesh, and the sphere around its center holding every vertex"""
+    minimum: np.ndarray
+    maximum: np.ndarray
+    center: np.ndarray
+    half_extents: np.ndarray
+    radius: float
+
+    def as_box(self) -> tuple:
+        """(center x, y, z, half size x, y, z) as floats, the layout the GBX writers use"""
+        return tuple(self.center.tolist() + self.half_extents.tolist())
+
+
+def compute_bounds(positions: np.ndarray) -> Bounds:
+    """Bounds of the vertex positions (N, 3), computed in double precision"""
+    positions = np.asarray(positions, dtype=np.float64).reshape(-1, 3)
+    if len(positions) == 0:
+        raise ValueError('cannot compute the bounds of a mesh without vertices')
+    minimum = positions.min(axis=0)
+    maximum = positions.max(axis=0)
+    center = (maximum + minimum) / 2
+    offsets = positions - center
+    radius = float(np.sqrt(np.einsum('ij,ij->i', offsets, offsets).max()))
+    return Bounds(minimum, maximum, center, (maximum - minimum) / 2, radius)
+
+
+def weld_vertices(positions: np.ndarray, epsilon: float = 0.0) -> tuple:
+    """Merge vertices that are at most about `epsilon` apart, returns (positions, remap).
+
+    Positions are rounded to a grid of `epsilon` and the vertices landing on the same grid point
+    become one, kept where the first of them was. Two close vertices on either side of the middle
+    between grid points stay apart. 0 merges exact duplicates only. New vertices keep the order of
+    their first old vertex and `remap` holds the new index of every old vertex, so `remap[faces]`
+    are the faces of the welded mesh.
+    """
+    if epsilon < 0:
+        raise ValueError(f'Welding epsilon must not be negative, got {epsilon}')
+    positions = np.asarray(positions).reshape(-1, 3)
+    keys = positions if epsilon == 0 else np.round(positions / epsilon).astype(np.int64)
+    # equal keys end up next to each other, the first of a run is its first vertex as the sort is stable
+    order = np.lexsort(keys.T[::-1])
+    sorted_keys = keys[order]
+    starts = np.ones(len(keys), dtype=bool)
+    starts[1:] = (sorted_keys[1:] != sorted_keys[:-1]).any(axis=1)
+    first = order[starts]
+    # number the new vertices by their first vertex instead of by key
+    rank = np.empty(len(first), dtype=np.int64)
+    rank[np.argsort(first)] = np.arange(len(first))
+    remap = np.empty(len(keys), dtype=np.int64)
+    remap[order] = rank[np.cumsum(starts) - 1]
+    return positions[np.sort(first)], remap
+
+
+def _triangles(faces: np.ndarray) -> np.ndarray:
+    """Vertex indices (N, 3) of faces given as (N, 3) or (N, 4) with the 3ds flags column"""
+    faces = np.asarray(faces)
+    if faces.ndim != 2:  # no faces at all
+        faces = faces.reshape(-1, 3)
+    return faces[:, :3].astype(np.intp)
+
+
+def normalize(vectors: np.ndarray) -> np.ndarray:
+    """Scale each row to unit length, zero rows stay zero"""
+    lengths = np.sqrt(np.einsum('ij,ij->i', vectors, vectors))[:, None]
+    out = np.zeros_like(vectors)
+    np.divide(vectors, lengths, out=out, where=lengths > 0)
+    return out
+
+
+def face_normals(positions: np.ndarray, faces: np.ndarray) -> np.ndarray:
+    """Unit normals (N, 3) of the faces, following the 3ds winding. Zero-area faces get (0, 0, 0)"""
+    positions = np.asarray(positions, dtype=np.float64).reshape(-1, 3)
+    triangles = _triangles(faces)
+    a = positions[triangles[:, 0]]
+    return normalize(np.cross(a - positions[triangles[:, 1]], a - positions[triangles[:, 2]]))
+
+
+def face_planes(positions: np.ndarray, faces: np.ndarray) -> np.ndarray:
+    """Plane (N, 4) of every face: its unit normal and d, with normal . p + d = 0 on the face.
+
+    Normals point the same way as in face_normals. Degenerate faces, without area, get (0, 0, 0, 0).
+    """
+    positions = np.asarray(positions, dtype=np.float64).reshape(-1, 3)
+    triangles = _triangles(faces)
+    a = positions[triangles[:, 0]]
+    cross = np.cross(positions[triangles[:, 1]] - a, positions[triangles[:, 2]] - a)
+    # row dot products through matmul, which rounds them like numpy.dot does a single one
+    lengths = np.sqrt((cross[:, None, :] @ cross[:, :, None]).ravel())
+    valid = lengths > 0
+    planes = np.zeros((len(triangles), 4))
+    planes[valid, :3] = cross[valid] / lengths[valid, None]
+    planes[valid, 3] = -(planes[valid, None, :3] @ a[valid, :, None]).ravel()
+    return planes
+
+
+def _unknown_weighting(weighting: str) -> ValueError:
+    return ValueError(f'Unknown normal weighting "{weighting}", expected one of {", ".join(NORMAL_WEIGHTINGS)}')
+
+
+def _corner_angles(corners: np.ndarray) -> np.ndarray:
+    """Angles (N, 3) of triangles given by their corner positions (N, 3, 3)"""
+    # edges from each corner to the next and to the previous corner
+    to_next = np.roll(corners, -1, axis=1) - corners
+    to_previous = np.roll(corners, 1, axis=1) - corners
+    return np.arctan2(np.linalg.norm(np.cross(to_next, to_previous), axis=2),
+                      np.einsum('ijk,ijk->ij', to_next, to_previous))
+
+
+def _corner_normals(positions: np.ndarray, triangles: np.ndarray, weighting: str) -> np.ndarray:
+    """Weighted face normal of every corner (N * 3, 3), in face order"""
+    if weighting not in NORMAL_WEIGHTINGS:
+        raise _unknown_weighting(weighting)
+    corners = np.asarray(positions, dtype=np.float64).reshape(-1, 3)[triangles]
+    a = corners[:, 0]
+    cross = np.cross(a - corners[:, 1], a - corners[:, 2])
+    if weighting == 'area':  # the cross product is the normal scaled by twice the area already
+        return np.repeat(cross / 2, 3, axis=0)
+    normals = normalize(cross)
+    if weighting == 'uniform':
+        return np.repeat(normals, 3, axis=0)
+    return (normals[:, None, :] * _corner_angles(corners)[:, :, None]).reshape(-1, 3)
+
+
+def _sum_rows(index: np.ndarray, rows: np.ndarray, count: int) -> np.ndarray:
+    """Sum the rows (N, 3) into `count` rows by index, in order"""
+    sums = np.empty((count, 3))
+    for axis in range(3):
+        sums[:, axis] = np.bincount(index, weights=rows[:, axis], minlength=count)
+    return sums
+
+
+def vertex_normals(positions: np.ndarray, faces: np.ndarray, weighting: str = 'uniform') -> np.ndarray:
+    """Unit normals (N, 3) of the vertices, the weighted sum of the normals of the faces using each vertex.
+
+    Vertices no face uses, and vertices whose face normals cancel out, get (0, 0, 0).
+    """
+    positions = np.asarray(positions).reshape(-1, 3)
+    triangles = _triangles(faces)
+    # the sum only needs normalizing, dividing it by the face count first would not change its direction
+    return normalize(_sum_rows(triangles.ravel(), _corner_normals(positions, triangles, weighting), len(positions)))
+
+
+def smooth_vertex_normals(positions: np.ndarray, faces: np.ndarray, smoothing_groups: np.ndarray,
+                          weighting: str = 'uniform') -> tuple:
+    """Vertex normals following the 3ds smoothing groups, splitting vertices where needed.
+
+    `smoothing_groups` holds one bitmask per face. A face corner is smoothed with the other
+    faces around its vertex that share a group bit with it, a face without any group stays flat.
+    Corners of a vertex that end up with different normals become separate vertices, so this
+    returns (normals, faces, source): the normals of the new vertices, the faces (N, 3)
+    indexing them, and for every new vertex the index of the vertex it was split from.
+    """
+    positions = np.asarray(positions).reshape(-1, 3)
+    triangles = _triangles(faces)
+    masks = np.asarray(smoothing_groups, dtype=np.int64)
+
+    # one new vertex per (vertex, group mask) seen on the corners, a flat face gets its own
+    corners = triangles.ravel()
+    corner_faces = np.repeat(np.arange(len(triangles), dtype=np.int64), 3)
+    corner_masks = masks[corner_faces]
+    codes = np.where(corner_masks != 0, corner_masks, (1 << 32) + corner_faces)
+    keys, corner_vertex = np.unique(corners.astype(np.int64) << 33 | codes, return_inverse=True)
+    corner_vertex = corner_vertex.reshape(-1)
+    source = keys >> 33
+    vertex_masks = np.where(keys & (1 << 32), 0, keys & 0xffffffff)
+
+    # face normals summed per new vertex, in face order
+    sums = _sum_rows(corner_vertex, _corner_normals(positions, triangles, weighting), len(keys))
+
+    # add the sums of the other new vertices of the same vertex that share a group bit. Only new
+    # vertices with a group are paired, one per distinct mask around the vertex, flat faces keep
+    # their own sum. New vertices of one vertex are next to each other since the keys are sorted
+    grouped = np.flatnonzero(vertex_masks != 0)
+    grouped_source = source[grouped]
+    first = np.flatnonzero(np.r_[True, grouped_source[1:] != grouped_source[:-1]])
+    block_sizes = np.diff(np.r_[first, len(grouped)])
+    sizes = np.repeat(block_sizes, block_sizes)
+    starts = np.repeat(first, block_sizes)
+    pair_a = np.repeat(np.arange(len(grouped)), sizes)
+    pair_b = starts[pair_a] + np.arange(len(pair_a)) - np.repeat(np.cumsum(sizes) - sizes, sizes)
+    pair_a = grouped[pair_a]
+    pair_b = grouped[pair_b]
+    shared = (pair_a != pair_b) & (vertex_masks[pair_a] & vertex_masks[pair_b] != 0)
+    smoothed = sums + _sum_rows(pair_a[shared], sums[pair_b[shared]], len(keys))
+
+    return normalize(smoothed), corner_vertex.reshape(-1, 3), source
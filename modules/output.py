@@ -0,0 +1,99 @@
+import io
+import os
+import tarfile
+import time
+import xml.etree.ElementTree as ET
+import zipfile
+from typing import BinaryIO
+
+# Output archive suffixes and the tarfile modes that write them
+TAR_MODES = {
+    '.tar': 'w',
+    '.tar.gz': 'w:gz',
+    '.tgz': 'w:gz',
+    '.tar.bz2': 'w:bz2',
+    '.tar.xz': 'w:xz'
+}
+
+
+def _serialize(tree: ET.ElementTree) -> bytes:
+    data = io.BytesIO()
+    tree.write(data)
+    return data.getvalue()
+
+
+class DirectoryOutput:
+    """Writes each converted file into a directory, the current one by default"""
+    directory: str | None
+
+    def __init__(self, directory: str = None):
+        self.directory = directory
+
+    def write(self, name: str, tree: ET.ElementTree) -> str:
+        """Write `tree` as `name` and return where it went"""
+        path = name if self.directory is None else os.path.join(self.directory, name)
+        parent = os.path.dirname(path)
+        if parent:
+            os.makedirs(parent, exist_ok=True)
+        with open(path, 'wb') as f:
+            tree.write(f)
+        return path
+
+    def close(self):
+        pass
+
+
+class TarOutput:
+    """Writes the converted files as the members of a tar archive.
+
+    Members are only ever appended, so the archive can be a stream opened with mode 'w|',
+    such as stdout.
+    """
+    _tar: tarfile.TarFile
+
+    def __init__(self, tar: tarfile.TarFile):
+        self._tar = tar
+
+    def write(self, name: str, tree: ET.ElementTree) -> str:
+        data = _serialize(tree)
+        info = tarfile.TarInfo(name)
+        info.size = len(data)
+        info.mtime = int(time.time())
+        self._tar.addfile(info, io.BytesIO(data))
+        return name
+
+    def close(self):
+        self._tar.close()
+
+
+class ZipOutput:
+    """Writes the converted files into a new zip archive"""
+    _zip: zipfile.ZipFile
+
+    def __init__(self, path: str):
+        self._zip = zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED)
+
+    def write(self, name: str, tree: ET.ElementTree) -> str:
+        self._zip.writestr(name, _serialize(tree))
+        return name
+
+    def close(self):
+        self._zip.close()
+
+
+def open_output(target: str = None, stdout: BinaryIO = None):
+    """Output for a target given on the command line.
+
+    '-' streams a tar archive to `stdout`, a path ending in .zip or in one of the
+    TAR_MODES suffixes creates that archive, anything else is a directory.
+    """
+    if target == '-':
+        return TarOutput(tarfile.open(fileobj=stdout, mode='w|'))
+    if target is not None:
+        lower = target.lower()
+        if lower.endswith('.zip'):
+            return ZipOutput(target)
+        for suffix, mode in TAR_MODES.items():
+            if lower.endswith(suffix):
+                return TarOutput(tarfile.open(target, mode))
+    return DirectoryOutput(target)
@@ -1,10 +1,18 @@
+import fnmatch
+import json
 import logging
+import mmap
+import os
 import struct
-from io import BytesIO
+import sys
+import time
+from typing import BinaryIO, NamedTuple
 
 import numpy as np
 
 from CPlugErrors import NoTrimeshError
+from modules.archives import is_archive, read_single_model
+from modules.geometry import Bounds, compute_bounds, vertex_normals, weld_vertices
 
 class IncorrectFormatError(BaseException):
     pass
@@ -19,142 +27,497 @@ class DataError(BaseException):
         self.args = args
 
 
-def _read_asciiz_string(file: BytesIO) -> str:
-    out: str = ''
-    while True:
-        char = str(file.read(1), 'ascii')
-        if char == '':
-            raise DataError(file.tell(), ('asciiz string reached eof',))
-        if ord(char) == 0:  # null character found, break
-            break
-        out += char
-    return out
+class ChunkReader:
+    """Read cursor over a window of a shared buffer.
+
+    Behaves like the BytesIO it replaces (read/tell/seek relative to the window),
+    but read() returns memoryview slices and child chunks get readers over windows
+    of the same buffer, so walking nested chunks never copies their bytes.
+    """
+    __slots__ = ('view', 'start', 'end', 'pos')
+    view: memoryview
+    start: int
+    end: int
+    pos: int
+
+    def __init__(self, data, start: int = 0, end: int = None):
+        view = data if isinstance(data, memoryview) else memoryview(data)
+        if view.format != 'B' or view.ndim != 1:
+            view = view.cast('B')
+        self.view = view
+        self.start = start
+        self.end = len(view) if end is None else min(end, len(view))
+        self.pos = start
+
+    @property
+    def offset(self) -> int:
+        """Absolute position in the shared buffer"""
+        return self.pos
+
+    def read(self, size: int = -1) -> memoryview:
+        stop = self.end if size < 0 else min(self.pos + size, self.end)
+        data = self.view[self.pos:max(stop, self.pos)]
+        self.pos = max(stop, self.pos)
+        return data
+
+    def tell(self) -> int:
+        return self.pos - self.start
+
+    def seek(self, offset: int, whence: int = 0) -> int:
+        if whence == 1:
+            offset += self.pos
+        elif whence == 2:
+            offset += self.end
+        else:
+            offset += self.start
+        self.pos = max(offset, self.start)
+        return self.tell()
+
+
+NAME_ENCODING = 'utf-8'  # names that do not decode get U+FFFD in place of the bad bytes
+
+
+def _find_null(view: memoryview, start: int, end: int) -> int:
+    """Absolute position of the first null byte in view[start:end], -1 if there is none"""
+    buffer = view.obj
+    if len(buffer) == len(view) and hasattr(buffer, 'find'):  # bytes or mmap behind the whole view
+        return buffer.find(b'\0', start, end)
+    pos = start
+    while pos < end:
+        stop = min(pos + 64, end)
+        found = view[pos:stop].tobytes().find(b'\0')
+        if found >= 0:
+            return pos + found
+        pos = stop
+    return -1
+
+
+def _read_asciiz_string(file: ChunkReader, encoding: str = NAME_ENCODING) -> str:
+    end = _find_null(file.view, file.pos, file.end)
+    if end < 0:
+        file.pos = file.end
+        raise DataError(file.tell(), ('asciiz string reached eof',))
+    data = file.view[file.pos:end]
+    file.pos = end + 1
+    return str(data, encoding, 'replace')
+
+
+def _read_array(file: ChunkReader, dtype: str, count: int, width: int = 1) -> np.ndarray:
+    """Decode `count` rows of `width` little-endian values in one go, as an array in native byte order"""
+    item = np.dtype(dtype)
+    size = count * width * item.itemsize
+    data = file.read(size)
+    if len(data) != size:
+        raise struct.error(f'unpack requires a buffer of {size} bytes')
+    array = np.frombuffer(data, dtype=item).astype(item.newbyteorder('='))
+    if width > 1:
+        return array.reshape(count, width)
+    return array
+
+
+def _as_tuples(array: np.ndarray) -> list:
+    return list(map(tuple, array.tolist()))
+
+
+class ObjectFilter:
+    """Selects objects by glob patterns matched against their base name (the part before '$')"""
+    include: list
+    exclude: list
+
+    def __init__(self, include: list = None, exclude: list = None):
+        self.include = include or []
+        self.exclude = exclude or []
+
+    def matches(self, name: str) -> bool:
+        base_name = name.split('$')[0]
+        if self.include and not any(fnmatch.fnmatchcase(base_name, p) for p in self.include):
+            return False
+        return not any(fnmatch.fnmatchcase(base_name, p) for p in self.exclude)
+
+
+class ChunkRegistry:
+    """Maps chunk ids to the Chunk classes that decode them.
+
+    Ids in `skip` are passed over silently, other ids without a class are reported once.
+    Decoders can be added from outside this module, to the default registry or a copy:
+
+        @CHUNK_REGISTRY.register(0x4170)
+        class MyChunk(Chunk):
+            ...
+    """
+    classes: dict
+    skip: set
+    _reported: set
+
+    def __init__(self, classes: dict = None, skip: set = None):
+        self.classes = dict(classes or {})
+        self.skip = set(skip or ())
+        self._reported = set()
+
+    def register(self, chunk_id: int, chunk_class: type = None):
+        """Register `chunk_class` for `chunk_id`, or return a class decorator doing so"""
+        if chunk_class is None:
+            def decorator(cls: type) -> type:
+                self.register(chunk_id, cls)
+                return cls
+            return decorator
+        self.classes[chunk_id] = chunk_class
+        self.skip.discard(chunk_id)
+        return chunk_class
+
+    def unregister(self, chunk_id: int):
+        self.classes.pop(chunk_id, None)
+
+    def lookup(self, chunk_id: int) -> type | None:
+        return self.classes.get(chunk_id)
+
+    def report_unknown(self, chunk_id: int):
+        if chunk_id in self.skip or chunk_id in self._reported:
+            return
+        self._reported.add(chunk_id)
+        logging.warning(f'Unknown or unimplemented chunk "{hex(chunk_id)}", skipping...')
+
+    def copy(self) -> 'ChunkRegistry':
+        return ChunkRegistry(self.classes, self.skip)
+
+
+class ParsePlan:
+    """What to read from a file: the chunk types a conversion needs and which objects.
+
+    Chunks of other types are skipped over during indexing, so they are never decoded.
+    A decoder registered in place of a wanted type counts as that type when it subclasses it.
+    `chunk_types` None means every known chunk type. `registry` defaults to CHUNK_REGISTRY.
+    `encoding` is used for object, material and keyframer names.
+    """
+    chunk_types: set
+    object_filter: ObjectFilter
+    registry: ChunkRegistry
+    encoding: str
+
+    def __init__(self, chunk_types: set = None, object_filter: ObjectFilter = None, registry: ChunkRegistry = None,
+                 encoding: str = NAME_ENCODING):
+        self.chunk_types = chunk_types
+        self.object_filter = object_filter
+        self.registry = CHUNK_REGISTRY if registry is None else registry
+        self.encoding = encoding
+
+    def wants(self, chunk_class: type) -> bool:
+        """Whether chunks decoded by `chunk_class` are read, subclasses of a wanted type included"""
+        if self.chunk_types is None:
+            return True
+        return chunk_class is not None and issubclass(chunk_class, tuple(self.chunk_types))
+
+
+class ChunkIndexEntry(NamedTuple):
+    chunk_id: int
+    offset: int  # absolute offset of the chunk header
+    size: int
+    parent: int  # offset of the parent chunk, -1 for the root
+
+
+class ChunkEvent(NamedTuple):
+    depth: int
+    chunk_id: int
+    offset: int
+    payload: memoryview  # everything after the header, sub-chunks included
+
+
+def _walk_chunk(file: ChunkReader, plan: 'ParsePlan', parent: int = -1, depth: int = 0):
+    """Yield (depth, entry) for the chunk whose header is at the reader position and then
+    for its sub-chunks, depth first, reading only what is needed to find them.
+
+    Chunks the plan skips are not yielded and not descended into, the reader is moved
+    past the chunk either way. The root chunk (parent -1) is never skipped.
+    """
+    offset = file.offset
+    try:
+        chunk_id = struct.unpack('<H', file.read(2))[0]
+        chunk_size = struct.unpack('<I', file.read(4))[0]
+    except struct.error as e:
+        raise DataError(file.tell(), e.args)
+    if chunk_size < 6:
+        raise DataError(file.tell(), ('chunk is smaller than its header, impossible!',))
+    if offset + chunk_size > file.end:
+        raise DataError(file.tell(), ('chunk runs past the end of its parent',))
+    file.seek(offset + chunk_size - file.start)
+
+    chunk_class = plan.registry.lookup(chunk_id)
+    if parent != -1:
+        if chunk_id in plan.registry.skip:
+            return
+        if plan.chunk_types is not None and not plan.wants(chunk_class):
+            return
+    reader = ChunkReader(file.view, offset + 6, offset + chunk_size)
+    if chunk_class is not None and issubclass(chunk_class, ObjectBlock) and plan.object_filter is not None:
+        name = _read_asciiz_string(reader, plan.encoding)
+        if not plan.object_filter.matches(name):
+            logging.info('Skipping object "%s"', name)
+            return
+        reader.seek(0)
+
+    yield depth, ChunkIndexEntry(chunk_id, offset, chunk_size, parent)
+    if chunk_class is not None and chunk_class.has_children:
+        try:
+            max_children = chunk_class._skip_payload(reader)
+        except struct.error as e:
+            raise DataError(reader.tell(), e.args)
+        yield from _walk_children(reader, plan, offset, chunk_size, max_children, depth + 1)
+
+
+def _walk_children(file: ChunkReader, plan: 'ParsePlan', parent: int, parent_size: int, times: int = None,
+                   depth: int = 1):
+    """Yield (depth, entry) for the sibling chunks between the reader position and the end
+    of its window, and for their sub-chunks"""
+    count = 0
+    # Check if there are any other child chunks in the buffer
+    while file.end - file.pos >= 2 and (times is None or count < times):
+        if file.end - file.pos < 6:
+            raise DataError(file.tell(), ('chunk header reached end of parent',))
+        chunk_size = struct.unpack_from('<I', file.view, file.pos + 2)[0]
+        if chunk_size > parent_size:
+            raise DataError(file.tell(), ('child chunk is bigger than parents, impossible!',))
+        for item in _walk_chunk(file, plan, parent, depth):
+            if item[0] == depth:
+                count += 1
+            yield item
+
+
+class ChunkIndex:
+    """Header-only map of a chunk tree.
+
+    Built by reading just the 6-byte chunk headers (plus whatever payload has to be
+    skipped to reach the sub-chunks of a container), so no chunk is decoded to build it.
+    """
+    view: memoryview
+    plan: ParsePlan
+    entries: list
+    _children: dict
+
+    def __init__(self, view: memoryview, plan: ParsePlan = None):
+        self.view = view
+        self.plan = plan or ParsePlan()
+        self.entries: list = []
+        self._children: dict = {}
+
+    def children_of(self, offset: int) -> list:
+        return self._children.get(offset, [])
+
+    def is_scanned(self, offset: int) -> bool:
+        return offset in self._children
+
+    def _add(self, entry: ChunkIndexEntry):
+        self.entries.append(entry)
+        self._children.setdefault(entry.offset, [])
+        if entry.parent != -1:
+            self._children[entry.parent].append(entry)
+
+    def add_chunk(self, file: ChunkReader):
+        """Index the chunk whose header is at the reader position, along with its sub-chunks"""
+        for _, entry in _walk_chunk(file, self.plan):
+            self._add(entry)
+
+    def scan(self, file: ChunkReader, parent: int, parent_size: int, times: int = None):
+        """Index the sibling chunks between the reader position and the end of its window"""
+        self._children.setdefault(parent, [])
+        for _, entry in _walk_children(file, self.plan, parent, parent_size, times):
+            self._add(entry)
+
+
+class ParseTrace:
+    """Counters collected while tracing is on, see start_trace()"""
+    chunks: dict  # chunk id -> chunks decoded
+    bytes: dict  # chunk id -> bytes decoded
+    seconds: dict  # decoder class name -> seconds spent decoding, sub-chunks excluded
+    _nested: list
+
+    def __init__(self):
+        self.chunks: dict = {}
+        self.bytes: dict = {}
+        self.seconds: dict = {}
+        self._nested: list = []
+
+    def _begin(self):
+        self._nested.append(0.0)
+
+    def _end(self, chunk: 'Chunk', elapsed: float):
+        nested = self._nested.pop()
+        if self._nested:  # decoded from inside the parent's _decode
+            self._nested[-1] += elapsed
+        chunk_id = chunk.my_chunk_id
+        self.chunks[chunk_id] = self.chunks.get(chunk_id, 0) + 1
+        self.bytes[chunk_id] = self.bytes.get(chunk_id, 0) + chunk.my_chunk_size
+        name = chunk.__class__.__name__
+        self.seconds[name] = self.seconds.get(name, 0.0) + elapsed - nested
+
+    def as_dict(self) -> dict:
+        return {
+            'chunks': {f'{chunk_id:#06x}': count for chunk_id, count in sorted(self.chunks.items())},
+            'bytes': {f'{chunk_id:#06x}': size for chunk_id, size in sorted(self.bytes.items())},
+            'seconds': dict(sorted(self.seconds.items(), key=lambda item: -item[1]))
+        }
+
+    def dump(self, fp):
+        json.dump(self.as_dict(), fp, indent=2)
+
+
+_trace: ParseTrace | None = None
+
+
+def start_trace() -> ParseTrace:
+    """Start counting decoded chunks, replacing any trace in progress"""
+    global _trace
+    _trace = ParseTrace()
+    return _trace
+
+
+def stop_trace() -> ParseTrace | None:
+    """Stop tracing and return what was collected"""
+    global _trace
+    trace, _trace = _trace, None
+    return trace
 
 
 class Chunk:
+    """Base of all chunk types.
+
+    The header is read on construction. The payload is decoded by `_decode`, either
+    right away or, for lazy chunks, the first time one of its attributes is accessed.
+    Once decoded the chunk lets go of the file buffer, only `offset` and `my_chunk_size`
+    still point back into it. A DataError raised by a lazy decode is raised again on every
+    later access, instead of the chunk looking decoded with its attributes missing.
+    """
+    __slots__ = ('my_chunk_id', 'my_chunk_size', 'offset', 'children', 'file', '_decoded', '_error', '_index',
+                 '_lazy')
     my_chunk_id: int
     my_chunk_size: int
-    children: list = []
-    file: BytesIO
-
-    def __init__(self, data: bytes):
-        logging.info(f'Reading "{self.__class__.__name__}"')
-        self.file = BytesIO(data)
-        self.children: list = []
+    offset: int
+    children: list
+    file: ChunkReader | None
+    has_children: bool = False  # sub-chunks follow the payload
+    max_children: int = None
+
+    def __init__(self, data: bytes | ChunkReader, index: ChunkIndex = None, lazy: bool = False):
+        logging.info('Reading "%s"', self.__class__.__name__)
+        self._decoded = False
+        self._error = None
+        self._index = index
+        self._lazy = lazy
+        self.file = data if isinstance(data, ChunkReader) else ChunkReader(data)
+        self.offset = self.file.start
         try:
             self.my_chunk_id = struct.unpack('<H', self.file.read(2))[0]
             self.my_chunk_size = struct.unpack('<I', self.file.read(4))[0]
-            logging.info(f'Chunk size: {self.my_chunk_size}')
+            logging.info('Chunk size: %d', self.my_chunk_size)
         except struct.error as e:
             raise DataError(self.file.tell(), e.args)
-
-    def _load_children(self, times: int = 99999999):
+        if not lazy:
+            self.decode()
+
+    def __getattr__(self, name: str):
+        # only reached for attributes that are not set yet, which for a lazy chunk
+        # means its payload has not been decoded
+        if name.startswith('__') or name in ('_decoded', '_error'):
+            raise AttributeError(f"'{self.__class__.__name__}' object has no attribute '{name}'")
+        if self._error is not None:
+            raise self._error
+        if self._decoded:
+            raise AttributeError(f"'{self.__class__.__name__}' object has no attribute '{name}'")
+        self.decode()
+        return getattr(self, name)
+
+    def decode(self):
+        """Decode the payload, does nothing if it already was"""
+        if self._decoded:
+            return
+        self._decoded = True
+        self.children: list = []
+        trace = _trace
+        try:
+            if trace is None:
+                self._decode()
+            else:
+                trace._begin()
+                start = time.perf_counter()
+                try:
+                    self._decode()
+                finally:
+                    trace._end(self, time.perf_counter() - start)
+        except DataError as e:
+            self._error = e
+            raise
+        # the decoded attributes and children hold everything needed from here on
+        self.file = None
+        self._index = None
+
+    def _decode(self):
+        """Decode the payload, the reader is positioned right after the header"""
+        pass
+
+    @classmethod
+    def _skip_payload(cls, file: ChunkReader) -> int | None:
+        """Move the reader from the end of the header to the first sub-chunk.
+
+        Returns how many sub-chunks may follow, None for no limit.
+        """
+        return cls.max_children
+
+    @classmethod
+    def from_values(cls, chunk_id: int, children: list = None, **values) -> 'Chunk':
+        """Make an already decoded chunk out of its attribute values, with no file behind it"""
+        chunk = cls.__new__(cls)
+        chunk.my_chunk_id = chunk_id
+        chunk.my_chunk_size = 0
+        chunk.offset = -1
+        chunk.file = None
+        chunk._index = None
+        chunk._lazy = False
+        chunk._decoded = True
+        chunk._error = None
+        chunk.children = list(children or [])
+        for klass in cls.__mro__[:cls.__mro__.index(Chunk)]:
+            for name in klass.__dict__.get('__slots__', ()):
+                if name.startswith('_'):  # cached conversions, built on first use
+                    setattr(chunk, name, None)
+        for name, value in values.items():
+            setattr(chunk, name, value)
+        return chunk
+
+    def _read_name(self) -> str:
+        encoding = NAME_ENCODING if self._index is None else self._index.plan.encoding
+        return _read_asciiz_string(self.file, encoding)
+
+    def _load_children(self, times: int = None):
+        """Decode the sub-chunks, at most `times` of them, `max_children` by default"""
         logging.info('--++--')
-        logging.info(f'Reading children for "{self.__class__.__name__}"')
-        for i in range(times):
-            # Check if there are any other child chunks in the buffer
-            try:
-                chunk_id = struct.unpack('<H', self.file.read(2))[0]
-            except struct.error:
-                logging.info(f'No more chunks for "{self.__class__.__name__}"')
-                logging.info('--==--')
-                break
-            # Read child chunks
-            try:
-                chunk_size = struct.unpack('<I', self.file.read(4))[0]
-                if chunk_size > self.my_chunk_size:
-                    raise DataError(self.file.tell(), ('child chunk is bigger than parents, impossible!',))
-            except struct.error as e:
-                raise DataError(self.file.tell(), e.args)
-            logging.info(f'Next chunk: "{hex(chunk_id)}" of size {chunk_size}')
+        logging.info('Reading children for "%s"', self.__class__.__name__)
+        offset = self.file.start
+        if self._index is None:
+            self._index = ChunkIndex(self.file.view)
+        if not self._index.is_scanned(offset):
+            self._index.scan(self.file, offset, self.my_chunk_size, self.max_children if times is None else times)
+        registry = self._index.plan.registry
+        for entry in self._index.children_of(offset):
+            logging.info('Next chunk: "%#x" of size %d', entry.chunk_id, entry.size)
             logging.info('------------------')
-            # go back to start of the chunk
-
-            self.file.seek(-6, 1)
-            logging.info(f'Position: {hex(self.file.tell())}')
-            chunk_data = self.file.read(chunk_size)
-
-            try:
-                match chunk_id:
-                    case 0x0002:
-                        self.children.append(M3DVersion(chunk_data))
-                    case 0x0011:
-                        self.children.append(Color24(chunk_data))
-                    case 0x3d3d:
-                        self.children.append(EditorChunk(chunk_data))
-                    case 0x3d3e:
-                        self.children.append(EditorConfiguration(chunk_data))
-                    case 0x0100:
-                        self.children.append(MasterScale(chunk_data))
-                    case 0x4000:
-                        self.children.append(ObjectBlock(chunk_data))
-                    case 0x4100:
-                        self.children.append(TriangularMesh(chunk_data))
-                    case 0x4110:
-                        self.children.append(VerticesList(chunk_data))
-                    case 0x4112:
-                        self.children.append(VertexNormals(chunk_data))
-                    case 0x4115:
-                        self.children.append(VertexColors(chunk_data))
-                    case 0x4120:
-                        self.children.append(FacesDescription(chunk_data))
-                    case 0x4130:
-                        self.children.append(FacesMaterial(chunk_data))
-                    case 0x4140:
-                        self.children.append(MappingCoordinates(chunk_data))
-                    case 0x4145:
-                        self.children.append(MappingCoordinatesList(chunk_data))
-                    case 0x4150:
-                        self.children.append(SmoothGroup(chunk_data))
-                    case 0x4160:
-                        self.children.append(AxisMatrix(chunk_data))
-                    case 0xa000:
-                        self.children.append(MaterialName(chunk_data))
-                    case 0xa010:
-                        self.children.append(AmbientColor(chunk_data))
-                    case 0xa020:
-                        self.children.append(DiffuseColor(chunk_data))
-                    case 0xa030:
-                        self.children.append(SpecularColor(chunk_data))
-                    case 0xafff:
-                        self.children.append(MaterialBlock(chunk_data))
-                    case 0xb000:
-                        self.children.append(KeyFramerChunk(chunk_data))
-                    case 0xb002:
-                        self.children.append(KeyFramerObject(chunk_data))
-                    case 0xb008:
-                        self.children.append(Frames(chunk_data))
-                    case 0xb009:
-                        self.children.append(UnknownClass1(chunk_data))
-                    case 0xb00a:
-                        self.children.append(KeyFramerHDR(chunk_data))
-                    case 0xb010:
-                        self.children.append(KeyFramerObjectName(chunk_data))
-                    case 0xb013:
-                        self.children.append(KeyFramerObjectPivotPosition(chunk_data))
-                    case 0xb020:
-                        self.children.append(KeyFramerObjectPositionTrack(chunk_data))
-                    case 0xb021:
-                        self.children.append(KeyFramerObjectRotationTrack(chunk_data))
-                    case 0xb022:
-                        self.children.append(KeyFramerObjectScaleTrack(chunk_data))
-                    case 0xb030:
-                        self.children.append(KeyFramerObjectHierarchyPosition(chunk_data))
-                    case _:
-                        logging.warning(f'Unknown or unimplemented chunk "{hex(chunk_id)}", skipping...')
-            except DataError:
-                raise
+            logging.info('Position: %#x', entry.offset)
+            chunk_class = registry.lookup(entry.chunk_id)
+            if chunk_class is None:
+                registry.report_unknown(entry.chunk_id)
+                continue
+            chunk_data = ChunkReader(self.file.view, entry.offset, entry.offset + entry.size)
+            self.children.append(chunk_class(chunk_data, self._index, self._lazy))
+        logging.info('No more chunks for "%s"', self.__class__.__name__)
+        logging.info('--==--')
 
 
 class M3DVersion(Chunk):
+    __slots__ = ('version',)
     version: int
 
-    def __init__(self, data: bytes):
+    def _decode(self):
         try:
-            super().__init__(data)
-            self.children: list = []
             self.version = struct.unpack('<I', self.file.read(4))[0]
-            logging.info(f'Version: {self.version}')
+            logging.info('Version: %d', self.version)
         except struct.error as e:
             raise DataError(self.file.tell(), e.args)
         except DataError:
@@ -162,14 +525,13 @@ class M3DVersion(Chunk):
 
 
 class MasterScale(Chunk):
+    __slots__ = ('scale',)
     scale: float
 
-    def __init__(self, data: bytes):
+    def _decode(self):
         try:
-            super().__init__(data)
-            self.children: list = []
             self.scale = struct.unpack('<f', self.file.read(4))[0]
-            logging.info(f'Scale: {self.scale}')
+            logging.info('Scale: %s', self.scale)
         except struct.error as e:
             raise DataError(self.file.tell(), e.args)
         except DataError:
@@ -177,14 +539,13 @@ class MasterScale(Chunk):
 
 
 class EditorConfiguration(Chunk):
+    __slots__ = ('u1',)
     u1: int
 
-    def __init__(self, data: bytes):
+    def _decode(self):
         try:
-            super().__init__(data)
-            self.children: list = []
             self.u1 = struct.unpack('<I', self.file.read(4))[0]
-            logging.info(f'U1: {self.u1}')
+            logging.info('U1: %d', self.u1)
         except struct.error as e:
             raise DataError(self.file.tell(), e.args)
         except DataError:
@@ -192,48 +553,54 @@ class EditorConfiguration(Chunk):
 
 
 class AmbientColor(Chunk):
-    def __init__(self, data: bytes):
+    __slots__ = ()
+    has_children = True
+    max_children = 1
+
+    def _decode(self):
         try:
-            super().__init__(data)
-            self.children = []
-            super()._load_children(1)
+            self._load_children()
         except DataError:
             raise
 
 
 class DiffuseColor(Chunk):
-    def __init__(self, data: bytes):
+    __slots__ = ()
+    has_children = True
+    max_children = 1
+
+    def _decode(self):
         try:
-            super().__init__(data)
-            self.children = []
-            super()._load_children(1)
+            self._load_children()
         except DataError:
             raise
 
 
 class SpecularColor(Chunk):
-    def __init__(self, data: bytes):
+    __slots__ = ()
+    has_children = True
+    max_children = 1
+
+    def _decode(self):
         try:
-            super().__init__(data)
-            self.children = []
-            super()._load_children(1)
+            self._load_children()
         except DataError:
             raise
 
 
 class Color24(Chunk):
+    __slots__ = ('r', 'g', 'b')
     r: int
     g: int
     b: int
 
-    def __init__(self, data: bytes):
+    def _decode(self):
         try:
-            super().__init__(data)
             unpacked = struct.unpack('<BBB', self.file.read(3))
             self.r = unpacked[0]
             self.g = unpacked[1]
             self.b = unpacked[2]
-            logging.info(f'Color: {self.r} {self.g} {self.b}')
+            logging.info('Color: %d %d %d', self.r, self.g, self.b)
         except struct as e:
             raise DataError(self.file.tell(), e.args)
         except DataError:
@@ -241,82 +608,84 @@ class Color24(Chunk):
 
 
 class MaterialName(Chunk):
+    __slots__ = ('name',)
     name: str
 
-    def __init__(self, data: bytes):
+    def _decode(self):
         try:
-            super().__init__(data)
-            self.name = _read_asciiz_string(self.file)
-            logging.info(f'Material name: "{self.name}"')
+            self.name = self._read_name()
+            logging.info('Material name: "%s"', self.name)
         except DataError:
             raise
 
 
 class MaterialBlock(Chunk):
-    def __init__(self, data: bytes):
+    __slots__ = ()
+    has_children = True
+
+    def _decode(self):
         try:
-            super().__init__(data)
-            self.children: list = []
-            super()._load_children()
+            self._load_children()
         except DataError:
             raise
 
 
 class MappingCoordinates(Chunk):
-    uv: list = []
+    __slots__ = ('uvs', '_uv')
+    uvs: np.ndarray  # float32 (N, 2)
 
-    def __init__(self, data: bytes):
+    def _decode(self):
         try:
-            super().__init__(data)
-            self.children: list = []
-            self.uv: list = []
+            self._uv = None
             count = struct.unpack('<H', self.file.read(2))[0]
-            for i in range(count):
-                uv_element = struct.unpack('<ff', self.file.read(8))
-                self.uv.append(uv_element)
-            logging.info(f'UV Size: {len(self.uv)}')
+            self.uvs = _read_array(self.file, '<f4', count, 2)
+            logging.info('UV Size: %d', len(self.uvs))
         except struct.error as e:
             raise DataError(self.file.tell(), e.args)
         except DataError:
             raise
 
+    @property
+    def uv(self) -> list:
+        """`uvs` as a list of (u, v) tuples"""
+        if self._uv is None:
+            self._uv = _as_tuples(self.uvs)
+        return self._uv
+
 
 class MappingCoordinatesList(Chunk):
-    uv_list: list = []
+    __slots__ = ('uv_layers', '_uv_list')
+    uv_layers: list  # float32 (N, 2) per layer
 
-    def __init__(self, data: bytes):
+    def _decode(self):
         try:
-            super().__init__(data)
-            self.children: list = []
-            self.uv_list: list = []
+            self.uv_layers: list = []
+            self._uv_list = None
 
             count = struct.unpack('<H', self.file.read(2))[0]
             for i in range(count):
-                uv_coords: list = []
                 count2 = struct.unpack('<H', self.file.read(2))[0]
-                for j in range(count2):
-                    uv_element = struct.unpack('<ff', self.file.read(8))
-                    uv_coords.append(uv_element)
-                self.uv_list.append(uv_coords)
-            logging.info(f'UV List Size: {len(self.uv_list)}')
+                self.uv_layers.append(_read_array(self.file, '<f4', count2, 2))
+            logging.info('UV List Size: %d', len(self.uv_layers))
         except struct.error as e:
             raise DataError(self.file.tell(), e.args)
         except DataError:
             raise
 
+    @property
+    def uv_list(self) -> list:
+        """`uv_layers` as lists of (u, v) tuples"""
+        if self._uv_list is None:
+            self._uv_list = [_as_tuples(layer) for layer in self.uv_layers]
+        return self._uv_list
+
 
 class AxisMatrix(Chunk):
-    matrix: list = [
-        [0, 0, 0],
-        [0, 0, 0],
-        [0, 0, 0],
-        [0, 0, 0]
-    ]
+    __slots__ = ('matrix',)
+    matrix: list
 
-    def __init__(self, data: bytes):
+    def _decode(self):
         try:
-            super().__init__(data)
-            self.children: list = []
             self.matrix: list = [
                 [0, 0, 0],
                 [0, 0, 0],
@@ -326,7 +695,7 @@ class AxisMatrix(Chunk):
             for i in range(4):
                 for j in range(3):
                     self.matrix[i][j] = struct.unpack('<f', self.file.read(4))[0]
-            logging.info(self.matrix)
+            logging.info('%s', self.matrix)
         except struct.error as e:
             raise DataError(self.file.tell(), e.args)
         except DataError:
@@ -334,15 +703,11 @@ class AxisMatrix(Chunk):
 
 
 class SmoothGroup(Chunk):
-    smooth_group_list: list = []
+    __slots__ = ('smooth_group_list',)
+    smooth_group_list: list
 
-    def __init__(self, data: bytes):
-        try:
-            super().__init__(data)
-            self.children: list = []
-            self.smooth_group_list: list = []
-        except DataError:
-            raise
+    def _decode(self):
+        self.smooth_group_list: list = []
         while True:
             try:
                 self.smooth_group_list.append(struct.unpack('<I', self.file.read(4))[0])
@@ -351,162 +716,236 @@ class SmoothGroup(Chunk):
 
 
 class FacesMaterial(Chunk):
+    __slots__ = ('material_name', 'face_indices', '_applied_faces')
     material_name: str
-    applied_faces: list = []
+    face_indices: np.ndarray  # uint16 (N,)
 
-    def __init__(self, data: bytes):
+    def _decode(self):
         try:
-            super().__init__(data)
-            self.applied_faces: list = []
-            self.material_name = _read_asciiz_string(self.file)
-            logging.info(f'Name: "{self.material_name}"')
+            self._applied_faces = None
+            self.material_name = self._read_name()
+            logging.info('Name: "%s"', self.material_name)
 
             count = struct.unpack('<H', self.file.read(2))[0]
-            for i in range(count):
-                face_index = struct.unpack('<H', self.file.read(2))[0]
-                self.applied_faces.append(face_index)
+            self.face_indices = _read_array(self.file, '<u2', count)
         except struct.error as e:
             raise DataError(self.file.tell(), e.args)
         except DataError:
             raise
 
+    @property
+    def applied_faces(self) -> list:
+        """`face_indices` as a list of ints"""
+        if self._applied_faces is None:
+            self._applied_faces = self.face_indices.tolist()
+        return self._applied_faces
+
 
 class FacesDescription(Chunk):
-    polygons: list = []
+    __slots__ = ('faces', '_polygons')
+    faces: np.ndarray  # uint16 (N, 4)
+    has_children = True
+
+    @classmethod
+    def _skip_payload(cls, file: ChunkReader):
+        count = struct.unpack('<H', file.read(2))[0]
+        file.seek(count * 8, 1)
 
-    def __init__(self, data: bytes):
+    def _decode(self):
         try:
-            super().__init__(data)
-            self.children: list = []
-            self.polygons: list = []
+            self._polygons = None
             count = struct.unpack('<H', self.file.read(2))[0]
-            for i in range(count):
-                # polygon[3] is used for editor info, such as selected faces
-                polygon = struct.unpack('<HHHH', self.file.read(8))
-                self.polygons.append(polygon)
-            logging.info(f'Polygon count: {len(self.polygons)}')
-            super()._load_children()
+            # faces[:, 3] is used for editor info, such as selected faces
+            self.faces = _read_array(self.file, '<u2', count, 4)
+            logging.info('Polygon count: %d', len(self.faces))
+            self._load_children()
         except struct.error as e:
             raise DataError(self.file.tell(), e.args)
         except DataError:
             raise
 
+    @property
+    def polygons(self) -> list:
+        """`faces` as a list of (a, b, c, flags) tuples"""
+        if self._polygons is None:
+            self._polygons = _as_tuples(self.faces)
+        return self._polygons
+
 
 class Vertex:
-    pos: tuple = (0.0, 0.0, 0.0)
-    normal: tuple = (0.0, 0.0, 0.0)
+    __slots__ = ('pos', 'normal')
+    pos: tuple
+    normal: tuple
 
     def __init__(self, x: float = 0, y: float = 0, z: float = 0, *, position: tuple = None):
+        self.normal = (0.0, 0.0, 0.0)
         if position:
             self.pos = position
             return
         self.pos = (x, y, z)
-        self.normal = (0.0, 0.0, 0.0)
+
+
+class VertexBuffer:
+    """Sequence of vertices stored in a single float32 (N, 3) array.
+
+    Indexing and iterating hand out short-lived `Vertex` views of the rows, so no
+    per-vertex object lives longer than the code looking at it.
+    """
+    __slots__ = ('positions',)
+    positions: np.ndarray
+
+    def __init__(self, positions: np.ndarray = None):
+        if positions is None:
+            positions = np.empty((0, 3), dtype=np.float32)
+        self.positions = positions
+
+    def __len__(self) -> int:
+        return len(self.positions)
+
+    def __getitem__(self, item):
+        if isinstance(item, slice):
+            return VertexBuffer(self.positions[item])
+        return Vertex(position=tuple(self.positions[item].tolist()))
+
+    def __iter__(self):
+        for pos in self.positions.tolist():
+            yield Vertex(position=tuple(pos))
 
 
 class VerticesList(Chunk):
-    vertices: list = []
+    __slots__ = ('positions',)
+    positions: np.ndarray  # float32 (N, 3)
 
-    def __init__(self, data: bytes):
+    def _decode(self):
         try:
-            super().__init__(data)
-            self.vertices: list = []
             vertex_count = struct.unpack('<H', self.file.read(2))[0]
-            logging.info(f'Vertices count: {vertex_count}')
-            for i in range(vertex_count):
-                vertex = Vertex(position=struct.unpack('<fff', self.file.read(12)))
-                self.vertices.append(vertex)
+            logging.info('Vertices count: %d', vertex_count)
+            self.positions = _read_array(self.file, '<f4', vertex_count, 3)
         except struct.error as e:
             raise DataError(self.file.tell(), e.args)
         except DataError:
             raise
 
+    @property
+    def vertices(self) -> VertexBuffer:
+        """`positions` as a sequence of `Vertex` objects"""
+        return VertexBuffer(self.positions)
+
 
 class VertexNormals(Chunk):
-    vertex_normals: list = []
+    __slots__ = ('normals', '_vertex_normals')
+    normals: np.ndarray  # float32 (N, 3)
+    has_children = True
 
-    def __init__(self, data: bytes):
+    @classmethod
+    def _skip_payload(cls, file: ChunkReader) -> int:
+        count = struct.unpack('<H', file.read(2))[0]
+        file.seek(count * 12, 1)
+        return count
+
+    def _decode(self):
         try:
-            super().__init__(data)
-            self.vertex_normals: list = []
+            self._vertex_normals = None
             vertex_count = struct.unpack('<H', self.file.read(2))[0]
 
-            logging.info(f'Vertex normal count: {vertex_count}')
-            for i in range(vertex_count):
-                vertex_normal = struct.unpack('<fff', self.file.read(12))
-                self.vertex_normals.append(vertex_normal)
-            super()._load_children(vertex_count)
+            logging.info('Vertex normal count: %d', vertex_count)
+            self.normals = _read_array(self.file, '<f4', vertex_count, 3)
+            self._load_children(vertex_count)
         except struct.error as e:
             raise DataError(self.file.tell(), e.args)
         except DataError:
             raise
 
+    @property
+    def vertex_normals(self) -> list:
+        """`normals` as a list of (x, y, z) tuples"""
+        if self._vertex_normals is None:
+            self._vertex_normals = _as_tuples(self.normals)
+        return self._vertex_normals
+
 
 class VertexColors(Chunk):
-    vertex_colors: list = []
+    __slots__ = ('colors', '_vertex_colors')
+    colors: np.ndarray  # uint8 (N, 3)
+    has_children = True
+
+    @classmethod
+    def _skip_payload(cls, file: ChunkReader) -> int:
+        count = struct.unpack('<H', file.read(2))[0]
+        file.seek(count * 3, 1)
+        return count
 
-    def __init__(self, data: bytes):
+    def _decode(self):
         try:
-            super().__init__(data)
-            self.vertex_colors: list = []
+            self._vertex_colors = None
             vertex_count = struct.unpack('<H', self.file.read(2))[0]
 
-            logging.info(f'Vertex color count: {vertex_count}')
-            for i in range(vertex_count):
-                vertex_color = struct.unpack('<BBB', self.file.read(3))
-                self.vertex_colors.append(vertex_color)
-            super()._load_children(vertex_count)
+            logging.info('Vertex color count: %d', vertex_count)
+            self.colors = _read_array(self.file, '<u1', vertex_count, 3)
+            self._load_children(vertex_count)
         except struct.error as e:
             raise DataError(self.file.tell(), e.args)
         except DataError:
             raise
 
+    @property
+    def vertex_colors(self) -> list:
+        """`colors` as a list of (r, g, b) tuples"""
+        if self._vertex_colors is None:
+            self._vertex_colors = _as_tuples(self.colors)
+        return self._vertex_colors
+
 
 class TriangularMesh(Chunk):
-    def __init__(self, data: bytes):
+    __slots__ = ()
+    has_children = True
+
+    def _decode(self):
         try:
-            super().__init__(data)
-            self.children: list = []
-            super()._load_children()
+            self._load_children()
         except DataError:
             raise
 
 
 class ObjectBlock(Chunk):
+    __slots__ = ('name',)
     name: str
+    has_children = True
 
-    def __init__(self, data: bytes):
+    @classmethod
+    def _skip_payload(cls, file: ChunkReader):
+        _read_asciiz_string(file)
+
+    def _decode(self):
         try:
-            super().__init__(data)
-            self.children: list = []
-            self.name = _read_asciiz_string(self.file)
-            logging.info(f'Name: "{self.name}"')
-            super()._load_children()
+            self.name = self._read_name()
+            logging.info('Name: "%s"', self.name)
+            self._load_children()
         except DataError:
             raise
 
 
 class EditorChunk(Chunk):
-    def __init__(self, data: bytes):
+    __slots__ = ()
+    has_children = True
+
+    def _decode(self):
         try:
-            super().__init__(data)
-            self.children: list = []
-            super()._load_children()
+            self._load_children()
         except DataError:
             raise
 
 
 class KeyFramerHDR(Chunk):
+    __slots__ = ('u1', 'u2', 'u3')
     u1: int
     u2: str
     u3: int
 
-    def __init__(self, data: bytes):
+    def _decode(self):
         try:
-            super().__init__(data)
-            self.children: list = []
             self.u1 = struct.unpack('<H', self.file.read(2))[0]
-            self.u2 = _read_asciiz_string(self.file)
+            self.u2 = self._read_name()
             self.u1 = struct.unpack('<I', self.file.read(4))[0]
         except struct.error as e:
             raise DataError(self.file.tell(), e.args)
@@ -515,21 +954,113 @@ class KeyFramerHDR(Chunk):
 
 
 class KeyFramerChunk(Chunk):
-    def __init__(self, data: bytes):
+    __slots__ = ()
+    has_children = True
+
+    def _decode(self):
         try:
-            super().__init__(data)
-            self.children: list = []
-            super()._load_children()
+            self._load_children()
         except DataError:
             raise
 
 
+class MergedMesh:
+    """Several objects as one mesh, built by `merge_objects`.
+
+    `faces` index the merged `positions`. For every face `material_ids` holds its index in
+    `materials`, -1 for a face without a material, and `object_ids` the index of its object.
+    """
+    __slots__ = ('positions', 'faces', 'material_ids', 'materials', 'object_ids', '_bounds')
+    positions: np.ndarray  # float32 (N, 3)
+    faces: np.ndarray  # int64 (M, 3)
+    material_ids: np.ndarray  # int32 (M,)
+    materials: list
+    object_ids: np.ndarray  # int32 (M,)
+
+    def __init__(self, positions: np.ndarray, faces: np.ndarray, material_ids: np.ndarray, materials: list,
+                 object_ids: np.ndarray):
+        self.positions = positions
+        self.faces = faces
+        self.material_ids = material_ids
+        self.materials = materials
+        self.object_ids = object_ids
+        self._bounds = None
+
+    @property
+    def vertices(self) -> VertexBuffer:
+        """`positions` as a sequence of `Vertex` objects"""
+        return VertexBuffer(self.positions)
+
+    @property
+    def bounds(self) -> Bounds:
+        """Bounds of the merged vertices, computed once"""
+        if self._bounds is None:
+            self._bounds = compute_bounds(self.positions)
+        return self._bounds
+
+    def welded(self, epsilon: float = 0.0) -> 'MergedMesh':
+        """Copy with the vertices merged by `weld_vertices`, without the faces that collapse doing so"""
+        positions, remap = weld_vertices(self.positions, epsilon)
+        faces = remap[self.faces]
+        keep = (faces[:, 0] != faces[:, 1]) & (faces[:, 1] != faces[:, 2]) & (faces[:, 2] != faces[:, 0])
+        return MergedMesh(positions, faces[keep], self.material_ids[keep], self.materials, self.object_ids[keep])
+
+
+def merge_objects(objects: list) -> MergedMesh:
+    """Merge the meshes of the objects into one, in object order.
+
+    The arrays of every object are offset by the vertex count of the objects before it and
+    concatenated once. When a mesh has several vertex or face chunks the last one is used.
+    """
+    positions: list = []
+    faces: list = []
+    material_ids: list = []
+    object_ids: list = []
+    materials: dict = {}  # name -> id, in order of first use
+    vertex_count = 0
+
+    for object_id, model_object in enumerate(objects):
+        trimesh: TriangularMesh = model_object.children[0]
+        if not trimesh or not isinstance(trimesh, TriangularMesh):
+            raise NoTrimeshError
+
+        vertices = description = None
+        for child in trimesh.children:
+            if isinstance(child, VerticesList):
+                vertices = child
+            if isinstance(child, FacesDescription):
+                description = child
+
+        if description is not None:
+            face_count = len(description.faces)
+            faces.append(description.faces[:, :3].astype(np.int64) + vertex_count)
+            face_materials = np.full(face_count, -1, dtype=np.int32)
+            for child in description.children:
+                if isinstance(child, FacesMaterial):
+                    indices = child.face_indices[child.face_indices < face_count]
+                    face_materials[indices] = materials.setdefault(child.material_name, len(materials))
+            material_ids.append(face_materials)
+            object_ids.append(np.full(face_count, object_id, dtype=np.int32))
+        if vertices is not None:
+            positions.append(vertices.positions)
+            vertex_count += len(vertices.positions)
+
+    return MergedMesh(
+        np.concatenate(positions) if positions else np.empty((0, 3), dtype=np.float32),
+        np.concatenate(faces) if faces else np.empty((0, 3), dtype=np.int64),
+        np.concatenate(material_ids) if material_ids else np.empty(0, dtype=np.int32),
+        list(materials),
+        np.concatenate(object_ids) if object_ids else np.empty(0, dtype=np.int32)
+    )
+
+
 class MainChunk(Chunk):
-    def __init__(self, data: bytes):
+    __slots__ = ()
+    has_children = True
+
+    def _decode(self):
         try:
-            super().__init__(data)
-            self.children: list = []
-            super()._load_children()
+            self._load_children()
         except DataError:
             raise
 
@@ -544,84 +1075,33 @@ class MainChunk(Chunk):
                             objects.append(obj)
         return objects
 
+    def GetMergedMesh(self) -> MergedMesh:
+        return merge_objects(self.GetAllObjects())
+
     def GetAllVertices(self, UseVertex: bool = False):
-        objects = self.GetAllObjects()
-        vertices_all = []
-
-        for model_object in objects:
-            trimesh: TriangularMesh = model_object.children[0]
-            if not trimesh or not isinstance(trimesh, TriangularMesh):
-                raise NoTrimeshError
-            for child in trimesh.children:
-                if isinstance(child, VerticesList):
-                    for vert in child.vertices:
-                        vert: Vertex
-                        if UseVertex:
-                            vertices_all.append(vert)
-                        else:
-                            vertices_all.append(vert.pos)
-
-        return vertices_all
+        positions = self.GetMergedMesh().positions
+        if UseVertex:
+            return list(VertexBuffer(positions))
+        return _as_tuples(positions)
 
     def GetAllFaces(self):
-        objects = self.GetAllObjects()
-
-        vert_count = 0
-        face_count = 0
-        vertices_all = []
-        triangles_all = []
-
-        # adding all the vertices and faces into big global arrays
-        # setting the vertex and face indexes by an offset
-        for model_object in objects:
-            new_vert_count = 0
-            new_face_count = 0
-
-            trimesh: TriangularMesh = model_object.children[0]
-            if not trimesh or not isinstance(trimesh, TriangularMesh):
-                raise NoTrimeshError
-
-            for child in trimesh.children:
-                if isinstance(child, VerticesList):
-                    new_vert_count = len(child.vertices)
-                    vertices_all = vertices_all + child.vertices
-
-                if isinstance(child, FacesDescription):
-                    temp = child.polygons.copy()
-                    for i in range(len(temp)):  # Update vertex references
-                        poly = temp[i]
-                        new_poly = (poly[0] + vert_count, poly[1] + vert_count, poly[2] + vert_count)
-                        temp[i] = new_poly
-                    new_face_count = len(temp)
-                    triangles_all = triangles_all + temp
-
-            vert_count = vert_count + new_vert_count
-            face_count = face_count + new_face_count
-
-        return triangles_all
-
-    def GetAllNormals(self):
-        normal_all = []
-        normals = compute_normals(self.GetAllVertices(True), self.GetAllFaces())
-        for norm in normals:
-            n = []
-            for k in norm:
-                n.append(k)
-            normal_all.append(n)
-        return normal_all
+        return _as_tuples(self.GetMergedMesh().faces)
+
+    def GetAllNormals(self, weighting: str = 'uniform'):
+        mesh = self.GetMergedMesh()
+        return vertex_normals(mesh.positions, mesh.faces, weighting).tolist()
 
     def GetBoundingBox(self):
-        verts = self.GetAllVertices(True)
-        return _calculate_bounding_box(verts)
+        return self.GetMergedMesh().bounds.as_box()
 
 
 class Frames(Chunk):
-    start_frame: int = 0
-    end_frame: int = 0
+    __slots__ = ('start_frame', 'end_frame')
+    start_frame: int
+    end_frame: int
 
-    def __init__(self, data: bytes):
+    def _decode(self):
         try:
-            super().__init__(data)
             self.start_frame = struct.unpack('<I', self.file.read(4))[0]
             self.end_frame = struct.unpack('<I', self.file.read(4))[0]
         except DataError:
@@ -629,35 +1109,36 @@ class Frames(Chunk):
 
 
 class UnknownClass1(Chunk):
-    u1: int = 0
+    __slots__ = ('u1',)
+    u1: int
 
-    def __init__(self, data: bytes):
+    def _decode(self):
         try:
-            super().__init__(data)
             self.u1 = struct.unpack('<I', self.file.read(4))[0]
         except DataError:
             raise
 
 
 class KeyFramerObject(Chunk):
-    def __init__(self, data: bytes):
+    __slots__ = ()
+    has_children = True
+
+    def _decode(self):
         try:
-            super().__init__(data)
-            self.children: list = []
-            super()._load_children()
+            self._load_children()
         except DataError:
             raise
 
 
 class KeyFramerObjectName(Chunk):
-    name: str = ''
-    u1: int = 0
-    u2: int = 0
+    __slots__ = ('name', 'u1', 'u2')
+    name: str
+    u1: int
+    u2: int
 
-    def __init__(self, data: bytes):
+    def _decode(self):
         try:
-            super().__init__(data)
-            self.name = _read_asciiz_string(self.file)
+            self.name = self._read_name()
             self.u1 = struct.unpack('<I', self.file.read(4))[0]
             self.u2 = struct.unpack('<H', self.file.read(2))[0]
         except DataError:
@@ -665,13 +1146,13 @@ class KeyFramerObjectName(Chunk):
 
 
 class KeyFramerObjectPivotPosition(Chunk):
-    x: float = 0
-    y: float = 0
-    z: float = 0
+    __slots__ = ('x', 'y', 'z')
+    x: float
+    y: float
+    z: float
 
-    def __init__(self, data: bytes):
+    def _decode(self):
         try:
-            super().__init__(data)
             self.x = struct.unpack('<f', self.file.read(4))[0]
             self.y = struct.unpack('<f', self.file.read(4))[0]
             self.z = struct.unpack('<f', self.file.read(4))[0]
@@ -680,11 +1161,11 @@ class KeyFramerObjectPivotPosition(Chunk):
 
 
 class KeyFramerObjectPositionTrack(Chunk):
-    frames: list = []
+    __slots__ = ('frames', 'u2')
+    frames: list
 
-    def __init__(self, data: bytes):
+    def _decode(self):
         try:
-            super().__init__(data)
             self.frames = []
             self.file.read(10)  # idk
             n_keys = self.u2 = struct.unpack('<H', self.file.read(2))[0]
@@ -702,11 +1183,11 @@ class KeyFramerObjectPositionTrack(Chunk):
 
 
 class KeyFramerObjectRotationTrack(Chunk):
-    frames: list = []
+    __slots__ = ('frames', 'u2')
+    frames: list
 
-    def __init__(self, data: bytes):
+    def _decode(self):
         try:
-            super().__init__(data)
             self.frames = []
             self.file.read(10)  # idk
             n_keys = self.u2 = struct.unpack('<H', self.file.read(2))[0]
@@ -725,102 +1206,202 @@ class KeyFramerObjectRotationTrack(Chunk):
 
 
 class KeyFramerObjectScaleTrack(KeyFramerObjectPositionTrack):
-    def __init__(self, data: bytes):
-        try:
-            super().__init__(data)
-
-        except DataError:
-            raise
+    __slots__ = ()
 
 
 class KeyFramerObjectHierarchyPosition(Chunk):
-    u1: int = 0
+    __slots__ = ('u1', 'u2')
+    u1: int
 
-    def __init__(self, data: bytes):
+    def _decode(self):
         try:
-            super().__init__(data)
             self.u2 = struct.unpack('<H', self.file.read(2))[0]
         except DataError:
             raise
 
 
-def compute_normals(vertex: list[Vertex], facet: list[tuple]):
-    normals = []
-    vertexNormalLists = [[] for i in range(0, len(vertex))]
-    for face in facet:
-        a = vertex[face[0]].pos
-        b = vertex[face[1]].pos
-        c = vertex[face[2]].pos
-        AB = np.array(a) - np.array(b)
-        AC = np.array(a) - np.array(c)
-        n = np.cross(AB, AC)
-        n /= np.linalg.norm(n)
-        for i in range(0, 3):
-            vertexNormalLists[face[i]].append(n)
-    for idx, normalList in enumerate(vertexNormalLists):
-        normalSum = np.zeros(3)
-        for normal in normalList:
-          normalSum += normal
-        normal = normalSum / float(len(normalList))
-        normal /= np.linalg.norm(normal)
-        normals.append(map(float, normal.tolist()))
-    return normals
-
-
-def _calculate_bounding_box(verts):
-    max_x = verts[0].pos[0]
-    max_y = verts[0].pos[1]
-    max_z = verts[0].pos[2]
-    min_x = max_x
-    min_y = max_y
-    min_z = max_z
-    for v in verts:
-        # get biggest x y z values
-        if v.pos[0] > max_x:
-            max_x = v.pos[0]
-        if v.pos[1] > max_y:
-            max_y = v.pos[1]
-        if v.pos[2] > max_z:
-            max_z = v.pos[2]
-        # get smallest x y z values
-        if v.pos[0] < min_x:
-            min_x = v.pos[0]
-        if v.pos[1] < min_y:
-            min_y = v.pos[1]
-        if v.pos[2] < min_z:
-            min_z = v.pos[2]
-    # calculate center of the mesh
-    cen_x = (max_x + min_x) / 2
-    cen_y = (max_y + min_y) / 2
-    cen_z = (max_z + min_z) / 2
-    # calculate size of the mesh
-    siz_x = (max_x - min_x) / 2
-    siz_y = (max_y - min_y) / 2
-    siz_z = (max_z - min_z) / 2
-    return cen_x, cen_y, cen_z, siz_x, siz_y, siz_z
-
-
-def read_3ds(path: str) -> MainChunk:
+CHUNK_REGISTRY = ChunkRegistry({
+    0x0002: M3DVersion,
+    0x0011: Color24,
+    0x3d3d: EditorChunk,
+    0x3d3e: EditorConfiguration,
+    0x0100: MasterScale,
+    0x4000: ObjectBlock,
+    0x4100: TriangularMesh,
+    0x4110: VerticesList,
+    0x4112: VertexNormals,
+    0x4115: VertexColors,
+    0x4120: FacesDescription,
+    0x4130: FacesMaterial,
+    0x4140: MappingCoordinates,
+    0x4145: MappingCoordinatesList,
+    0x4150: SmoothGroup,
+    0x4160: AxisMatrix,
+    0x4d4d: MainChunk,
+    0xa000: MaterialName,
+    0xa010: AmbientColor,
+    0xa020: DiffuseColor,
+    0xa030: SpecularColor,
+    0xafff: MaterialBlock,
+    0xb000: KeyFramerChunk,
+    0xb002: KeyFramerObject,
+    0xb008: Frames,
+    0xb009: UnknownClass1,
+    0xb00a: KeyFramerHDR,
+    0xb010: KeyFramerObjectName,
+    0xb013: KeyFramerObjectPivotPosition,
+    0xb020: KeyFramerObjectPositionTrack,
+    0xb021: KeyFramerObjectRotationTrack,
+    0xb022: KeyFramerObjectScaleTrack,
+    0xb030: KeyFramerObjectHierarchyPosition
+})
+
+
+def _sizeof_value(value) -> int:
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, (list, tuple)):
+        return sys.getsizeof(value) + sum(_sizeof_value(item) for item in value)
+    if isinstance(value, dict):
+        return sys.getsizeof(value) + sum(_sizeof_value(item) for item in value.values())
+    return sys.getsizeof(value)
+
+
+def sizeof_tree(chunk: Chunk) -> dict:
+    """Report how much memory a chunk tree takes, in bytes.
+
+    `nodes` is the chunk objects and their child lists, `decoded` the decoded values,
+    `buffers` the file buffers still held by chunks that were never decoded.
+    Undecoded chunks are not decoded by this.
+    """
+    report = {'chunks': 0, 'decoded_chunks': 0, 'nodes': 0, 'decoded': 0, 'buffers': 0}
+    buffers = {}
+    pending = [chunk]
+    while pending:
+        node = pending.pop()
+        report['chunks'] += 1
+        report['nodes'] += sys.getsizeof(node)
+        if not node._decoded:
+            buffers[id(node.file.view.obj)] = node.file.view.nbytes
+            continue
+        report['decoded_chunks'] += 1
+        report['nodes'] += sys.getsizeof(node.children)
+        pending.extend(node.children)
+        for cls in type(node).__mro__[:-2]:  # own fields only, not Chunk's
+            for name in cls.__dict__.get('__slots__', ()):
+                if hasattr(node, name):
+                    report['decoded'] += _sizeof_value(getattr(node, name))
+    report['buffers'] = sum(buffers.values())
+    report['total'] = report['nodes'] + report['decoded'] + report['buffers']
+    return report
+
+
+# A path, the file contents, or a binary stream positioned at the start of the 3ds data
+Source = str | os.PathLike | bytes | bytearray | memoryview | BinaryIO
+
+
+def _map_file(file) -> memoryview:
+    """Map an open file read-only, or read it whole if it cannot be mapped (pipes, empty files)"""
     try:
-        file = open(path, 'rb')
-    except OSError:
-        raise
-    logging.info(f'Parsing file "{path}"...')
-    chunk_id = hex(struct.unpack('<H', file.read(2))[0])
+        return memoryview(mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ))
+    except (OSError, ValueError):
+        logging.info('Input cannot be memory-mapped, reading it into memory')
+        return memoryview(file.read())
+
+
+def _source_name(source: Source) -> str:
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return '<bytes>'
+    if hasattr(source, 'read'):
+        return str(getattr(source, 'name', '<stream>'))
+    return str(source)
+
+
+def _open_3ds(source: Source) -> ChunkReader:
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        reader = ChunkReader(source)
+    elif hasattr(source, 'read'):
+        # read from the current position, a stream may be a pipe or already partly consumed
+        reader = ChunkReader(source.read())
+    else:
+        try:
+            file = open(source, 'rb')
+        except OSError:
+            raise
+        with file:
+            # the chunk tree reads straight from the mapping, which outlives the file handle
+            reader = ChunkReader(_map_file(file))
+        if bytes(reader.view[:2]) != b'MM' and is_archive(source):
+            # a zip or tar asset pack holding a single model
+            data = read_single_model(source)
+            if data is None:
+                raise IncorrectFormatError
+            reader = ChunkReader(data)
+    chunk_id = hex(struct.unpack('<H', reader.read(2))[0])
     if chunk_id != '0x4d4d':
         raise IncorrectFormatError
+    reader.seek(0)
+    return reader
+
+
+def index_3ds(source: Source, plan: ParsePlan = None) -> ChunkIndex:
+    """Index the chunk headers of a 3ds file without decoding any chunk.
+
+    `source` is a path, the file contents as bytes, or a binary stream to read them from.
+    The path can also be a zip or tar archive holding a single .3ds file.
+    Chunks and objects the plan does not want are skipped over and left out of the index.
+    """
+    logging.info(f'Indexing file "{_source_name(source)}"...')
+    reader = _open_3ds(source)
+    index = ChunkIndex(reader.view, plan)
+    index.add_chunk(reader)
+    logging.info(f'Indexed {len(index.entries)} chunks')
+    return index
+
+
+def iter_chunks(source: Source, plan: ParsePlan = None):
+    """Yield a ChunkEvent for each chunk of a 3ds file in file order, without decoding any.
+
+    Headers are read as the generator advances, the payloads are views of the mapped file.
+    """
+    reader = _open_3ds(source)
+    for depth, entry in _walk_chunk(reader, plan or ParsePlan()):
+        yield ChunkEvent(depth, entry.chunk_id, entry.offset, reader.view[entry.offset + 6:entry.offset + entry.size])
+
+
+def iter_objects(source: Source, plan: ParsePlan = None, lazy: bool = True):
+    """Yield the ObjectBlocks of a 3ds file one at a time, in file order.
+
+    Each object is indexed only when it is reached and shares nothing with the others,
+    so it can be converted and released before the next one is read.
+    """
+    plan = plan or ParsePlan()
+    reader = _open_3ds(source)
+    outline = ParsePlan({EditorChunk, ObjectBlock}, plan.object_filter, plan.registry, plan.encoding)
+    for _, entry in _walk_chunk(reader, outline):
+        chunk_class = plan.registry.lookup(entry.chunk_id)
+        if chunk_class is None or not issubclass(chunk_class, ObjectBlock):
+            continue
+        object_data = ChunkReader(reader.view, entry.offset, entry.offset + entry.size)
+        index = ChunkIndex(reader.view, plan)
+        index.add_chunk(object_data)
+        object_data.seek(0)
+        yield chunk_class(object_data, index, lazy)
+
+
+def read_3ds(source: Source, lazy: bool = True, plan: ParsePlan = None) -> MainChunk:
+    """Parse a 3ds file.
+
+    The chunk headers are indexed up front, the chunks themselves are decoded when
+    their attributes are first accessed, or right away with `lazy=False`.
+    Chunks and objects the plan does not want are skipped without being decoded.
+    """
+    index = index_3ds(source, plan)
+    root = index.entries[0]
     try:
-        chunk_size = struct.unpack('<I', file.read(4))[0]
-    except struct.error as e:
-        raise DataError(file.tell(), e.args)
-    # go back to start of the chunk
-    file.seek(-6, 1)
-    chunk_data = file.read(chunk_size)
-    try:
-        chunk = MainChunk(chunk_data)
+        chunk = MainChunk(ChunkReader(index.view, root.offset, root.offset + root.size), index, lazy)
     except DataError:
         raise
 
-    file.close()
     logging.info('Parsing complete!')
     return chunk
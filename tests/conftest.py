@@ -0,0 +1,5 @@
+import os
+import sys
+
+# the converter is run from the repository root, its modules are imported from there
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
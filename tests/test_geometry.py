@@ -0,0 +1,40 @@
+import tracemalloc
+
+import numpy as np
+
+from modules.geometry import smooth_vertex_normals
+
+
+def _fan(count: int) -> tuple:
+    """`count` triangles around the vertex 0 at the origin, as (positions, faces)"""
+    angles = np.linspace(0, 2 * np.pi, count + 1)
+    rim = np.column_stack((np.cos(angles), np.sin(angles), 0.1 * np.cos(3 * angles)))
+    positions = np.vstack(((0, 0, 0), rim))
+    faces = np.column_stack((np.zeros(count, dtype=np.int64), np.arange(1, count + 1), np.arange(2, count + 2)))
+    return positions, faces
+
+
+def test_smoothing_wide_fan():
+    count = 5000
+    positions, faces = _fan(count)
+    # every third face is flat, the others are in one of four groups
+    index = np.arange(count)
+    masks = np.where(index % 3 == 0, 0, 1 << (index % 4))
+
+    tracemalloc.start()
+    try:
+        normals, new_faces, source = smooth_vertex_normals(positions, faces, masks)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    assert peak < 16 * 1024 * 1024
+
+    # the center is split into one vertex per flat face and one per group
+    centers = np.unique(new_faces[:, 0])
+    assert np.all(source[centers] == 0)
+    assert len(centers) == np.count_nonzero(masks == 0) + 4
+    # a flat face keeps its own normal at the center
+    flat = np.flatnonzero(masks == 0)[0]
+    a, b, c = positions[faces[flat]]
+    expected = np.cross(a - b, a - c)
+    assert np.allclose(normals[new_faces[flat, 0]], expected / np.linalg.norm(expected))
@@ -0,0 +1,51 @@
+import struct
+
+import numpy as np
+import pytest
+
+import CPlugSurface
+from modules.threedees import CHUNK_REGISTRY, DataError, EditorChunk, FacesDescription, ParsePlan, VerticesList, iter_objects
+
+
+def _chunk(chunk_id: int, payload: bytes = b'', children: tuple = ()) -> bytes:
+    body = payload + b''.join(children)
+    return struct.pack('<HI', chunk_id, 6 + len(body)) + body
+
+
+def _model(positions: list, faces: list) -> bytes:
+    """A 3ds file with one object holding the mesh"""
+    vertices = _chunk(0x4110, struct.pack('<H', len(positions))
+                      + b''.join(struct.pack('<fff', *p) for p in positions))
+    polygons = _chunk(0x4120, struct.pack('<H', len(faces)) + b''.join(struct.pack('<HHHH', *f, 0) for f in faces))
+    mesh = _chunk(0x4000, b'box\0', (_chunk(0x4100, b'', (vertices, polygons)),))
+    return _chunk(0x4d4d, b'', (_chunk(0x3d3d, b'', (mesh,)),))
+
+
+class FastVertices(VerticesList):
+    __slots__ = ()
+
+
+def test_plan_reads_registered_subclass():
+    registry = CHUNK_REGISTRY.copy()
+    registry.register(0x4110, FastVertices)
+    plan = ParsePlan({EditorChunk} | CPlugSurface.REQUIRED_CHUNKS, registry=registry)
+    data = _model([(0, 0, 0), (1, 0, 0), (0, 1, 0)], [(0, 1, 2)])
+
+    objects = list(iter_objects(data, plan))
+    assert len(objects) == 1
+    children = objects[0].children[0].children
+    assert [type(child) for child in children] == [FastVertices, FacesDescription]
+    assert np.array_equal(children[0].positions, [(0, 0, 0), (1, 0, 0), (0, 1, 0)])
+
+
+def test_plan_skips_unwanted_types():
+    plan = ParsePlan({EditorChunk, FacesDescription})
+    assert plan.wants(FastVertices) is False
+    assert plan.wants(None) is False
+    assert ParsePlan().wants(FastVertices)
+
+
+def test_truncated_file_is_an_error():
+    data = _model([(0, 0, 0), (1, 0, 0), (0, 1, 0)], [(0, 1, 2)])
+    with pytest.raises(DataError):
+        list(iter_objects(data[:-4]))